@@ -15,6 +15,9 @@
 import json
 import argparse
 
+from evaluation.aggregate import average_rows, averaged_columns
+from evaluation.results import read_results
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -23,7 +26,7 @@ def get_args():
         "--input_file",
         type=str,
         required=True,
-        help="json file recording sythesised wav and evaluation metrics",
+        help="json (or .parquet) file recording sythesised wav and evaluation metrics",
     )
     parser.add_argument(
         "--result_file",
@@ -31,55 +34,44 @@ def get_args():
         required=True,
         help="result file recoring the averged metrics",
     )
+    parser.add_argument(
+        "--group_by",
+        type=str,
+        default=None,
+        help="also aggregate per value of this result field (e.g. speaker, lang, system), "
+             "key_prefix groups by the part of the key before --key_sep",
+    )
+    parser.add_argument(
+        "--key_sep",
+        type=str,
+        default="_",
+        help="separator ending the key prefix of --group_by key_prefix",
+    )
+    parser.add_argument(
+        "--percentiles",
+        type=str,
+        default="",
+        help="comma separated percentiles to report, e.g. 50,90,99, "
+             "estimated from a reservoir sample of every metric",
+    )
+    parser.add_argument(
+        "--reservoir_size",
+        type=int,
+        default=10000,
+        help="values sampled per metric (and group) for --percentiles",
+    )
     return parser.parse_args()
 
 
 def main():
     args = get_args()
-    pesq_lst = []
-    wer_lst = []
-    ins_lst = []
-    del_lst = []
-    sub_lst = []
-    f0_rmse_lst = []
-    utmos_lst = []
-    mcd_lst = []
-    cos_sim_lst = []
-    with open(args.input_file, 'r') as fin:
-        for line in fin.readlines():
-            line_dict = json.loads(line)
-            pesq = float(line_dict['pesq'])
-            wer = float(line_dict['wer'])
-            ins = float(line_dict['ins'])
-            del_ = float(line_dict['del'])
-            sub = float(line_dict['sub'])
-            f0_rmse = float(line_dict['f0_rmse'])
-            utmos = float(line_dict['utmos'])
-            mcd = float(line_dict['mcd'])
-            cos_sim = float(line_dict['cos_sim'])
-
-            pesq_lst.append(pesq)
-            wer_lst.append(wer)
-            ins_lst.append(ins)
-            del_lst.append(del_)
-            sub_lst.append(sub)
-            f0_rmse_lst.append(f0_rmse)
-            utmos_lst.append(utmos)
-            mcd_lst.append(mcd)
-            cos_sim_lst.append(cos_sim)
-    out_dict = {}
-    out_dict['pesq'] = str(sum(pesq_lst) / len(pesq_lst))
-    out_dict['wer'] = str(sum(wer_lst) / len(wer_lst))
-    out_dict['ins'] = str(sum(ins_lst) / len(ins_lst))
-    out_dict['del'] = str(sum(del_lst) / len(del_lst))
-    out_dict['sub'] = str(sum(sub_lst) / len(sub_lst))
-    out_dict['f0_rmse'] = str(sum(f0_rmse_lst) / len(f0_rmse_lst))
-    out_dict['utmos'] = str(sum(utmos_lst) / len(utmos_lst))
-    out_dict['mcd'] = str(sum(mcd_lst) / len(mcd_lst))
-    out_dict['cos_sim'] = str(sum(cos_sim_lst) / len(cos_sim_lst))
+    percentiles = [float(q) for q in args.percentiles.split(',') if q.strip()]
+    # parquet results are read for the averaged columns only
+    rows = read_results(args.input_file, averaged_columns(args.group_by))
+    out_dict = average_rows(rows, args.group_by, args.key_sep, percentiles, args.reservoir_size)
     with open(args.result_file, 'w') as fout:
-        json.dump(out_dict, fout)
-    print(out_dict)
+        json.dump(out_dict, fout, ensure_ascii=False)
+    print({field: value for field, value in out_dict.items() if field not in ('stats', 'groups')})
     print(f'Save result to {args.result_file}')
 
 
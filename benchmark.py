@@ -0,0 +1,338 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter
+from evaluation.audio import Audio, AudioPair, SR_16K, SR_22K
+from evaluation.profiling import peak_rss_mb
+from evaluation.wer import compute_wer
+from evaluation.metrics import METRICS, ModelHub, default_builders, parse_metrics
+
+BENCH_SR = 24000
+BENCH_TEXT = 'the quick brown fox jumps over the lazy dog'
+# (centre frequency, bandwidth) of the formants of a neutral vowel
+FORMANTS = [(500, 80), (1500, 100), (2500, 120)]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="benchmark the metric extractors on synthetic speech-like audio.")
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=",".join(METRICS),
+        help=f"comma separated metrics to benchmark, from {','.join(METRICS)}"
+    )
+    parser.add_argument(
+        "--durations",
+        type=str,
+        default="1,5,10,30,60",
+        help="comma separated utterance durations in seconds"
+    )
+    parser.add_argument(
+        "--methods",
+        type=str,
+        default="cut,dtw",
+        help="length alignment methods benchmarked for pesq and f0_rmse"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="timed calls per metric, method and duration"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="utterances per call of the model metrics"
+    )
+    parser.add_argument(
+        "--real_models",
+        action="store_true",
+        help="benchmark the real asr, sv and utmos models instead of the stubs, "
+             "needs the model weights"
+    )
+    parser.add_argument(
+        "--lang",
+        type=str,
+        default='en',
+        help="language of the asr model with --real_models"
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default='cpu',
+        help="device of the real models"
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        default=None,
+        help="json file receiving the benchmark results"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="results of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative latency increase over the baseline counted as a regression"
+    )
+    return parser.parse_args()
+
+
+def synth_speech(duration, sr=BENCH_SR, f0=120.0, seed=0):
+    """Speech-like test signal: a glottal pulse train with a wandering,
+    vibrato modulated f0, shaped by three formant resonators and a syllable
+    rate envelope, with unvoiced noise bursts and short pauses."""
+    rng = np.random.RandomState(seed)
+    n = int(duration * sr)
+    t = np.arange(n) / sr
+    contour = f0 * (1 + 0.15 * np.sin(2 * np.pi * 0.3 * t + rng.rand() * 6)
+                    + 0.02 * np.sin(2 * np.pi * 5.5 * t))
+    phase = np.cumsum(contour) / sr
+    source = np.diff(np.floor(phase), prepend=0.0)
+    source += 0.05 * rng.randn(n) * (np.sin(2 * np.pi * 1.7 * t) > 0.8)
+    wav = source
+    for freq, bandwidth in FORMANTS:
+        r = np.exp(-np.pi * bandwidth / sr)
+        wav = lfilter([1 - r], [1, -2 * r * np.cos(2 * np.pi * freq / sr), r * r], wav)
+    envelope = 0.5 * (1 - np.cos(2 * np.pi * 4 * t)) * (np.sin(2 * np.pi * 0.5 * t) > -0.9)
+    wav = wav * envelope
+    return (0.5 * wav / (np.abs(wav).max() + 1e-8)).astype(np.float32)
+
+
+def synth_degraded(wav, seed=1):
+    """Synthesized counterpart of wav: 5% slower, slightly noisy."""
+    rng = np.random.RandomState(seed)
+    positions = np.arange(0, len(wav) - 1, 1 / 1.05)
+    deg = np.interp(positions, np.arange(len(wav)), wav)
+    deg = deg + 0.005 * rng.randn(len(deg))
+    return deg.astype(np.float32)
+
+
+def _log_mel_mean(wav, dim=64):
+    # a little length proportional numpy work standing in for a network
+    frames = np.lib.stride_tricks.sliding_window_view(wav, 400)[::160]
+    spec = np.abs(np.fft.rfft(frames * np.hanning(400), 512))
+    return np.log(spec[:, :dim] + 1e-6).mean(0)
+
+
+class StubASR:
+    model_id = 'stub'
+    decode_params = {}
+
+    def infer_batch(self, audios, batch_size=1, texts=None):
+        for audio in audios:
+            _log_mel_mean(audio.resample(SR_16K))
+        return [BENCH_TEXT for _ in audios]
+
+    def get_wer(self, ref_text, hyp_text):
+        return compute_wer(ref_text, hyp_text, 'en')
+
+
+class StubSV:
+
+    def compute_cos_sim_scores(self, audio_pairs, batch_size=1):
+        scores = []
+        for audio_pair in audio_pairs:
+            ref = _log_mel_mean(audio_pair.ref.resample(SR_16K))
+            deg = _log_mel_mean(audio_pair.deg.resample(SR_16K))
+            scores.append(float(ref @ deg / np.linalg.norm(ref) / np.linalg.norm(deg)))
+        return scores
+
+
+class StubUTMOS:
+
+    def compute_utmos_scores(self, audio_pairs, batch_size=1):
+        return [float(_log_mel_mean(audio_pair.deg.resample(SR_16K)).mean())
+                for audio_pair in audio_pairs]
+
+
+def stub_builders():
+    return {
+        'asr': StubASR,
+        'sv': StubSV,
+        'utmos': StubUTMOS,
+        'hypotheses': lambda: None,
+    }
+
+
+def write_pairs(tmp_dir, durations, count):
+    """count reference / synthesized wav pairs of every duration."""
+    pairs = {}
+    for duration in durations:
+        pairs[duration] = []
+        for i in range(count):
+            ref = synth_speech(duration, seed=i)
+            ref_path = os.path.join(tmp_dir, f'ref_{duration:g}_{i}.wav')
+            deg_path = os.path.join(tmp_dir, f'deg_{duration:g}_{i}.wav')
+            sf.write(ref_path, ref, BENCH_SR)
+            sf.write(deg_path, synth_degraded(ref, seed=i), BENCH_SR)
+            pairs[duration].append((ref_path, deg_path))
+    return pairs
+
+
+def measure(fn, repeats, audio_seconds):
+    """Latency and throughput of repeats calls of fn(), after an untimed warm up
+    call that also records the peak traced memory (tracing slows the calls down)."""
+    tracemalloc.start()
+    fn()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    mean = float(np.mean(latencies))
+    return {
+        'mean_s': mean,
+        'p50_s': float(np.median(latencies)),
+        'min_s': float(np.min(latencies)),
+        'audio_seconds_per_second': audio_seconds / mean if mean > 0 else 0.0,
+        'peak_mb': peak_bytes / 1024 ** 2,
+    }
+
+
+def fresh_pair(audio_pair):
+    """AudioPair sharing the decoded views of audio_pair but none of its
+    memoised features, so that every timed call extracts them again."""
+    audios = []
+    for audio in (audio_pair.ref, audio_pair.deg):
+        copy = Audio(audio.path)
+        copy._sr = audio._sr
+        copy._views = dict(audio._views)
+        audios.append(copy)
+    return AudioPair(*audios)
+
+
+def run_benchmarks(args, metric_names, durations, methods, models, pairs):
+    results = {}
+    sample_rates = (SR_16K, SR_22K)
+    for duration in durations:
+        paths = pairs[duration]
+        # decode: reading and resampling one pair to every view
+        name = f'decode/-/{duration:g}s'
+        results[name] = measure(
+            lambda: AudioPair(*paths[0]).decode(*sample_rates), args.repeats, 2 * duration)
+        print(name, results[name])
+        for metric_name in metric_names:
+            metric = METRICS[metric_name]
+            for method in (methods if metric.aligned else ['-']):
+                # decoded once, the metric alone is timed. Every call gets fresh
+                # pairs, features memoised by an earlier call would be skipped
+                if metric.model is None:
+                    audio_pair = AudioPair(*paths[0])
+                    audio_pair.decode(*metric.sample_rates)
+                    fn = lambda: metric.compute(fresh_pair(audio_pair), method, None, {})
+                    seconds = duration
+                else:
+                    audio_pairs = [AudioPair(*path) for path in paths]
+                    for audio_pair in audio_pairs:
+                        audio_pair.decode(*metric.sample_rates)
+                    texts = [BENCH_TEXT] * len(audio_pairs)
+                    # build the model outside of the timed calls
+                    model = models.get(metric.model)
+
+                    def fn():
+                        # the reference embedding memo of SVPipeline outlives the pairs
+                        if hasattr(model, 'ref_embeddings'):
+                            model.ref_embeddings.clear()
+                        return metric.compute_batch(
+                            models, [fresh_pair(audio_pair) for audio_pair in audio_pairs],
+                            texts, args.batch_size)
+                    seconds = duration * len(audio_pairs)
+                name = f'{metric_name}/{method}/{duration:g}s'
+                results[name] = measure(fn, args.repeats, seconds)
+                print(name, results[name])
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Entries whose median latency grew by more than threshold over the baseline."""
+    regressions = []
+    print(f"{'benchmark':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['p50_s']
+        change = result['p50_s'] / before - 1 if before > 0 else 0.0
+        flag = ' REGRESSION' if change > threshold else ''
+        print(f"{name:<28}{before:>12.4f}{result['p50_s']:>12.4f}{change:>+10.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    args = get_args()
+    metric_names = parse_metrics(args.metrics)
+    durations = [float(d) for d in args.durations.split(',') if d.strip()]
+    methods = [m.strip() for m in args.methods.split(',') if m.strip()]
+    assert all(method in ['cut', 'dtw'] for method in methods)
+    assert args.repeats >= 1 and args.batch_size >= 1
+    if args.real_models:
+        models = ModelHub(default_builders(args.lang, args.device))
+    else:
+        models = ModelHub(stub_builders())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pairs = write_pairs(tmp_dir, durations, args.batch_size)
+        results = run_benchmarks(args, metric_names, durations, methods, models, pairs)
+
+    output = {
+        'config': {
+            'metrics': metric_names,
+            'durations': durations,
+            'methods': methods,
+            'repeats': args.repeats,
+            'batch_size': args.batch_size,
+            'real_models': args.real_models,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'peak_rss_mb': peak_rss_mb()[0],
+        'results': results,
+    }
+    if args.output_file is not None:
+        with open(args.output_file, 'w') as fout:
+            json.dump(output, fout, indent=2)
+        print(f'Save result to {args.output_file}')
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fin:
+            baseline = json.load(fin)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
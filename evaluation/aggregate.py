@@ -0,0 +1,202 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import random
+
+# per-utterance fields averaged by average.py
+AVERAGED_FIELDS = ['pesq', 'wer', 'ins', 'del', 'sub', 'f0_rmse', 'utmos', 'mcd', 'cos_sim']
+
+
+def to_float(value):
+    """Float of a result field, None for missing, non numeric or nan values."""
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value):
+        return None
+    return value
+
+
+class RunningStat:
+    """Constant memory count, mean, variance (Welford), min and max of a stream.
+    reservoir_size: keep a uniform sample of that many values for percentiles, 0 disables it.
+    """
+
+    def __init__(self, reservoir_size=0, seed=0):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.reservoir_size = reservoir_size
+        self.reservoir = []
+        self.random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if self.reservoir_size > 0:
+            if len(self.reservoir) < self.reservoir_size:
+                self.reservoir.append(value)
+            else:
+                j = self.random.randrange(self.count)
+                if j < self.reservoir_size:
+                    self.reservoir[j] = value
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def percentile(self, q):
+        """Percentile q (0-100) estimated from the reservoir, by linear interpolation."""
+        values = sorted(self.reservoir)
+        if not values:
+            return None
+        pos = (len(values) - 1) * q / 100
+        lower = math.floor(pos)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+    def to_dict(self, percentiles=()):
+        out = {
+            'count': self.count,
+            'mean': self.mean if self.count else None,
+            'std': self.std,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+        }
+        for q in percentiles:
+            out[f'p{q:g}'] = self.percentile(q)
+        return out
+
+
+def reference_length(line_dict):
+    """Number of reference tokens behind the wer of a row."""
+    if 'ref_len' in line_dict:
+        return to_float(line_dict['ref_len'])
+    if line_dict.get('ref_txt') is not None:
+        return float(len(line_dict['ref_txt']))
+    return None
+
+
+def edit_count(line_dict, wer, ref_len):
+    """Edits behind the wer of a row, sub + del + ins when stored so that
+    insertions on an empty reference are counted, wer * ref_len for rows
+    written without them."""
+    counts = [to_float(line_dict.get(field)) for field in ('sub', 'del', 'ins')]
+    if None not in counts:
+        return sum(counts)
+    return wer * ref_len
+
+
+class Aggregator:
+    """Single pass aggregation of result rows, overall and per group.
+    fields: result fields to aggregate.
+    reservoir_size: sample size per field and group for percentiles, 0 disables them.
+    """
+
+    def __init__(self, fields=AVERAGED_FIELDS, reservoir_size=0):
+        self.fields = fields
+        self.reservoir_size = reservoir_size
+        self.stats = {}
+        self.rows = 0
+        self.rows_with_errors = 0
+        # corpus wer = total edits / total reference tokens
+        self.edits = 0.0
+        self.ref_tokens = 0.0
+
+    def add(self, line_dict):
+        self.rows += 1
+        if line_dict.get('errors'):
+            self.rows_with_errors += 1
+        for field in self.fields:
+            value = to_float(line_dict.get(field))
+            if value is None:
+                continue
+            if field not in self.stats:
+                self.stats[field] = RunningStat(self.reservoir_size)
+            self.stats[field].add(value)
+        wer = to_float(line_dict.get('wer'))
+        ref_len = reference_length(line_dict)
+        if wer is not None and ref_len is not None:
+            self.edits += edit_count(line_dict, wer, ref_len)
+            self.ref_tokens += ref_len
+
+    @property
+    def corpus_wer(self):
+        return self.edits / self.ref_tokens if self.ref_tokens > 0 else None
+
+    def means(self):
+        """Mean of every field, the utterance level average."""
+        return {field: stat.mean for field, stat in self.stats.items() if stat.count}
+
+    def to_dict(self, percentiles=()):
+        return {
+            'rows': self.rows,
+            'rows_with_errors': self.rows_with_errors,
+            'corpus_wer': self.corpus_wer,
+            'metrics': {
+                field: stat.to_dict(percentiles) for field, stat in self.stats.items()
+            },
+        }
+
+
+def group_value(line_dict, group_by, key_sep='_'):
+    """Group of a row. group_by is a result field, or 'key_prefix' for the part
+    of the key before the first key_sep."""
+    if group_by == 'key_prefix':
+        return str(line_dict.get('key', '')).split(key_sep, 1)[0]
+    return str(line_dict.get(group_by))
+
+
+def average_rows(rows, group_by=None, key_sep='_', percentiles=(), reservoir_size=10000):
+    """average.py output of an iterable of result rows: the utterance level
+    means (as strings), corpus wer, stats and optionally the stats per group."""
+    reservoir_size = reservoir_size if percentiles else 0
+    total = Aggregator(AVERAGED_FIELDS, reservoir_size)
+    groups = {}
+    for line_dict in rows:
+        total.add(line_dict)
+        if group_by is not None:
+            group = group_value(line_dict, group_by, key_sep)
+            if group not in groups:
+                groups[group] = Aggregator(AVERAGED_FIELDS, reservoir_size)
+            groups[group].add(line_dict)
+
+    # utterance level means, as before
+    out_dict = {field: str(mean) for field, mean in total.means().items()}
+    out_dict['corpus_wer'] = str(total.corpus_wer) if total.corpus_wer is not None else None
+    out_dict['stats'] = total.to_dict(percentiles)
+    if group_by is not None:
+        out_dict['group_by'] = group_by
+        out_dict['groups'] = {
+            group: groups[group].to_dict(percentiles) for group in sorted(groups)
+        }
+    return out_dict
+
+
+def averaged_columns(group_by=None):
+    """Result columns read by average_rows."""
+    columns = AVERAGED_FIELDS + ['key', 'ref_len', 'ref_txt', 'errors']
+    if group_by is not None and group_by != 'key_prefix':
+        columns.append(group_by)
+    return columns
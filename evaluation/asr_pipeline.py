@@ -12,47 +12,136 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import string
 import zhconv
-import edit_distance
-from zhon import hanzi
-from faster_whisper import WhisperModel
-from funasr import AutoModel
+import numpy as np
+from evaluation.audio import SR_16K
+from evaluation.wer import normalize_text, compute_wer
+from evaluation.utils import length_sorted_batches
+
+WHISPER_MODEL = "large-v3"
+PARAFORMER_MODEL = "paraformer-zh"
+# whisper decodes 30 s windows, at most 448 tokens each
+WHISPER_CHUNK_SAMPLES = 30 * SR_16K
+WHISPER_MAX_LENGTH = 448
+WHISPER_BEAM_SIZE = 5
+WHISPER_MIN_SILENCE_MS = 700
+# token budget per reference word (and slack) of the text conditioned decode
+WHISPER_TOKENS_PER_WORD = 3
+WHISPER_LENGTH_SLACK = 16
+PARAFORMER_BATCH_SIZE_S = 300
 
 
 class ASRPipeline:
+    """ASR of the synthesized audio, faster-whisper for en and Paraformer for zh.
+    lang: language of the text, zh or en.
+    device: device of the model, e.g. cpu, cuda or cuda:1.
+    model: model name, large-v3 (en) or paraformer-zh (zh) if not set.
+    compute_type: faster-whisper weight/compute precision, e.g. int8, int8_float16, float16.
+    cpu_threads: faster-whisper intra-op threads on cpu, 0 uses the ctranslate2 default.
+    num_workers: faster-whisper model replicas, for concurrent transcriptions.
+    batched: transcribe clips over 30 s with faster-whisper's BatchedInferencePipeline,
+             which batches their VAD segments, instead of one segment at a time.
+    fast_path: opt-in, decode clips up to 30 s as one window, batched across
+               files, without VAD, temperature fallback or compression ratio
+               check. Faster, but WER may differ from the default transcribe path.
+    text_max_length: on the fast path, cap the decode length by the word count
+                     of the reference text, so a looping decode stops early.
+    """
 
-    def __init__(self, lang) -> None:
+    def __init__(self, lang, device='auto', model=None, compute_type='default',
+                 cpu_threads=0, num_workers=1, batched=False, fast_path=False,
+                 text_max_length=False) -> None:
         self.lang = lang
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.batched = batched
+        self.fast_path = fast_path
+        self.text_max_length = text_max_length
+        # model_id and decode_params identify the hypotheses, see HypothesisStore
         if self.lang == 'en':
-            self.asr_model = WhisperModel("large-v3")
+            self.model = model or WHISPER_MODEL
+            self.model_id = f'faster-whisper/{self.model}'
+            # on the fast path clips up to 30 s are decoded without VAD, clips
+            # over 30 s still go through transcribe with VAD
+            self.decode_params = {
+                'beam_size': WHISPER_BEAM_SIZE,
+                'max_length': WHISPER_MAX_LENGTH,
+                'vad_filter': 'over_30s' if fast_path else True,
+                'min_silence_duration_ms': WHISPER_MIN_SILENCE_MS,
+                'compute_type': compute_type,
+                'batched': batched,
+                'fast_path': fast_path,
+                'text_max_length': text_max_length,
+            }
         if self.lang == 'zh':
-            self.asr_model = AutoModel(model="paraformer-zh")
+            self.model = model or PARAFORMER_MODEL
+            self.model_id = f'funasr/{self.model}'
+            self.decode_params = {'batch_size_s': PARAFORMER_BATCH_SIZE_S, 'zhconv': 'zh-cn'}
+        self._asr_model = None
+        self._batched_model = None
+
+    @property
+    def asr_model(self):
+        """The ASR model, loaded on first use so that runs served from stored
+        hypotheses never load it."""
+        if self._asr_model is None:
+            # import only the toolkit of the language being evaluated
+            if self.lang == 'en':
+                from faster_whisper import WhisperModel
+                # ctranslate2 takes the device index separately
+                device, _, index = self.device.partition(':')
+                self._asr_model = WhisperModel(
+                    self.model,
+                    device=device,
+                    device_index=int(index or 0),
+                    compute_type=self.compute_type,
+                    cpu_threads=self.cpu_threads,
+                    num_workers=self.num_workers
+                )
+            if self.lang == 'zh':
+                from funasr import AutoModel
+                self._asr_model = AutoModel(model=self.model)
+        return self._asr_model
+
+    @property
+    def batched_model(self):
+        if self._batched_model is None:
+            from faster_whisper import BatchedInferencePipeline
+            self._batched_model = BatchedInferencePipeline(model=self.asr_model)
+        return self._batched_model
 
 
     def clean_text_en(self, text):
-        punctuation_str = string.punctuation
-        for i in punctuation_str:
-            text = text.replace(i, '')
-        text = text.lower()
-        return text
+        return normalize_text(text, 'en')
 
 
     def clean_text_zh(self, text):
-        punctuation_str = hanzi.punctuation + " "
-        for i in punctuation_str:
-            text = text.replace(i, '')
-        return text
-
-
-    def infer_en(self, wav):
-        segments, info = self.asr_model.transcribe(
-            wav,
-            language="en",
-            beam_size=5,
-            vad_filter=True,
-            vad_parameters=dict(min_silence_duration_ms=700)
-        )
+        return normalize_text(text, 'zh')
+
+
+    def infer_en(self, audio, batch_size=1):
+        wav = audio.resample(SR_16K)
+        # only long clips have several VAD segments to batch, the others keep
+        # the decoding of transcribe
+        if self.batched and len(wav) > WHISPER_CHUNK_SAMPLES:
+            segments, info = self.batched_model.transcribe(
+                wav,
+                language="en",
+                beam_size=WHISPER_BEAM_SIZE,
+                batch_size=batch_size,
+                vad_filter=True,
+                vad_parameters=dict(min_silence_duration_ms=WHISPER_MIN_SILENCE_MS)
+            )
+        else:
+            segments, info = self.asr_model.transcribe(
+                wav,
+                language="en",
+                beam_size=WHISPER_BEAM_SIZE,
+                vad_filter=True,
+                vad_parameters=dict(min_silence_duration_ms=WHISPER_MIN_SILENCE_MS)
+            )
         hyp_text = ""
         for segment in segments:
             hyp_text += segment.text
@@ -60,40 +149,82 @@ class ASRPipeline:
         return hyp_text
 
 
-    def infer_zh(self, wav):
-        res = self.asr_model.generate(input=wav, batch_size_s=300)
-        hyp_text = res[0]["text"]
-        hyp_text = zhconv.convert(hyp_text, 'zh-cn')
-        return hyp_text
+    def infer_en_batch(self, audios, batch_size=1, texts=None):
+        """Transcribe a list of Audio with infer_en, one file at a time. On the
+        fast path clips up to 30 s instead share one encoder and one beam search
+        pass per batch. texts: reference texts, bound the decode length when
+        text_max_length is set.
+        """
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.tokenizer import Tokenizer
 
+        hyp_texts = [None] * len(audios)
+        wavs = [audio.resample(SR_16K) for audio in audios]
+        short = []
+        for i, wav in enumerate(wavs):
+            if self.fast_path and len(wav) <= WHISPER_CHUNK_SAMPLES:
+                short.append(i)
+            else:
+                hyp_texts[i] = self.infer_en(audios[i], batch_size)
+        if not short:
+            return hyp_texts
 
-    def get_wer(self, ref_text, hyp_text):
+        tokenizer = Tokenizer(
+            self.asr_model.hf_tokenizer,
+            self.asr_model.model.is_multilingual,
+            task="transcribe",
+            language="en"
+        )
+        prompt = self.asr_model.get_prompt(tokenizer, [], without_timestamps=True)
+        for batch in length_sorted_batches([len(wavs[i]) for i in short], batch_size):
+            batch = [short[i] for i in batch]
+            features = np.stack([
+                pad_or_trim(self.asr_model.feature_extractor(wavs[i])) for i in batch
+            ])
+            max_length = WHISPER_MAX_LENGTH
+            if self.text_max_length and texts is not None:
+                max_words = max(len(texts[i].split()) for i in batch)
+                max_length = min(
+                    max_length,
+                    len(prompt) + WHISPER_TOKENS_PER_WORD * max_words + WHISPER_LENGTH_SLACK)
+            encoder_output = self.asr_model.encode(features)
+            results = self.asr_model.model.generate(
+                encoder_output,
+                [prompt] * len(batch),
+                beam_size=WHISPER_BEAM_SIZE,
+                max_length=max_length,
+                suppress_blank=True,
+            )
+            for i, result in zip(batch, results):
+                hyp_texts[i] = tokenizer.decode(result.sequences_ids[0]).strip()
+        return hyp_texts
+
+
+    def infer_zh(self, audio):
+        return self.infer_zh_batch([audio])[0]
+
+
+    def infer_zh_batch(self, audios, batch_size=1):
+        wavs = [audio.resample(SR_16K) for audio in audios]
+        hyp_texts = [None] * len(wavs)
+        for batch in length_sorted_batches([len(wav) for wav in wavs], batch_size):
+            res = self.asr_model.generate(
+                input=[wavs[i] for i in batch],
+                batch_size=len(batch),
+                batch_size_s=PARAFORMER_BATCH_SIZE_S
+            )
+            for i, item in zip(batch, res):
+                hyp_texts[i] = zhconv.convert(item["text"], 'zh-cn')
+        return hyp_texts
+
+
+    def infer_batch(self, audios, batch_size=1, texts=None):
         if self.lang == 'en':
-            ref_text = self.clean_text_en(ref_text)
-            hyp_text = self.clean_text_en(hyp_text)
-        elif self.lang == 'zh':
-            ref_text = self.clean_text_zh(ref_text)
-            hyp_text = self.clean_text_zh(hyp_text)
-        sm = edit_distance.SequenceMatcher(ref_text, hyp_text)
-        wer = sm.distance() / len(ref_text)
-        cor = sm.matches()
-
-        del_error = 0
-        ins_error = 0
-        sub_error = 0
-        for opcode in sm.get_opcodes():
-            if opcode[0] == "delete":
-                del_error += 1
-            elif opcode[0] == "insert":
-                ins_error += 1
-            elif opcode[0] == "replace":
-                sub_error += 1
-        return {
-            "ref": ref_text,
-            "hyp": hyp_text,
-            "wer": wer,
-            "cor": cor,
-            "del": del_error,
-            "ins": ins_error,
-            "sub": sub_error
-        }
+            return self.infer_en_batch(audios, batch_size, texts)
+        if self.lang == 'zh':
+            return self.infer_zh_batch(audios, batch_size)
+
+
+    def get_wer(self, ref_text, hyp_text):
+        """Word level for en, character level for zh."""
+        return compute_wer(ref_text, hyp_text, self.lang)
@@ -0,0 +1,224 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import itertools
+import librosa
+import numpy as np
+
+SR_16K = 16000
+SR_22K = 22050
+# names of unnamed tensors, unique within the process
+_TENSOR_IDS = itertools.count()
+
+
+class Audio:
+    """Waveform of one audio file, decoded once and shared by every metric.
+    The file is decoded lazily at its native sampling rate, resampled views
+    (e.g. 16 kHz for PESQ/ASR/SV, 22.05 kHz for F0/MCD) are computed on the
+    first request and cached.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sr = None
+        self._views = {}
+        self._content_hash = None
+        # features memoised for the lifetime of this object, see cache.cached
+        self.features = {}
+
+    def _load(self):
+        wav, sr = librosa.load(self.path, sr=None, mono=True)
+        self._sr = sr
+        self._views[sr] = wav
+
+    @property
+    def sr(self):
+        """Native sampling rate of the file."""
+        if self._sr is None:
+            self._load()
+        return self._sr
+
+    @property
+    def wav(self):
+        """Waveform at the native sampling rate."""
+        return self.resample(self.sr)
+
+    @property
+    def content_hash(self):
+        """sha1 of the file bytes, identifies the audio for cached features without decoding it."""
+        if self._content_hash is None:
+            sha1 = hashlib.sha1()
+            with open(self.path, 'rb') as fin:
+                for chunk in iter(lambda: fin.read(1 << 20), b''):
+                    sha1.update(chunk)
+            self._content_hash = sha1.hexdigest()
+        return self._content_hash
+
+    @property
+    def duration(self):
+        """Seconds of audio, from any view already computed, decoding the file otherwise."""
+        for sr, wav in self._views.items():
+            return len(wav) / sr
+        return len(self.wav) / self.sr
+
+    def resample(self, sr):
+        """Return the waveform at sampling rate `sr`, resampling at most once."""
+        if sr not in self._views:
+            self._views[sr] = librosa.resample(self.wav, orig_sr=self.sr, target_sr=sr)
+        return self._views[sr]
+
+
+class ArrayAudio(Audio):
+    """Audio of a waveform already in memory, e.g. sent inline to the
+    evaluation service, no file is read.
+    wav: mono waveform, or (channels, samples) which is averaged to mono.
+    sr: sampling rate of wav.
+    name: identifies the audio in results (kept as its path).
+    """
+
+    def __init__(self, wav, sr, name=None):
+        super().__init__(name)
+        wav = np.asarray(wav, dtype=np.float32)
+        if wav.ndim > 1:
+            wav = wav.mean(axis=0)
+        self._sr = sr
+        self._views[sr] = wav
+        if name is None:
+            # unnamed arrays are named after their content
+            self.path = f'array:{self.content_hash}'
+
+    @property
+    def content_hash(self):
+        """sha1 of the samples and sampling rate."""
+        if self._content_hash is None:
+            sha1 = hashlib.sha1(str(self._sr).encode('utf-8'))
+            sha1.update(np.ascontiguousarray(self._views[self._sr]).tobytes())
+            self._content_hash = sha1.hexdigest()
+        return self._content_hash
+
+
+class TensorAudio(Audio):
+    """Audio of a torch tensor, possibly on an accelerator.
+    Models running on the same device read tensor(sr), which stays on the
+    device, host side metrics read resample(sr), copied to the host once.
+    tensor: mono waveform, or (channels, samples) which is averaged to mono.
+    sr: sampling rate of tensor.
+    name: identifies the audio in results (kept as its path), unnamed
+          tensors get a name unique within the process.
+    """
+
+    def __init__(self, tensor, sr, name=None):
+        super().__init__(name if name is not None else f'tensor:{next(_TENSOR_IDS)}')
+        tensor = tensor.detach().float()
+        if tensor.dim() > 1:
+            tensor = tensor.mean(dim=0)
+        self._sr = sr
+        self._tensors = {sr: tensor}
+
+    def _load(self):
+        self._views[self._sr] = self._tensors[self._sr].cpu().numpy()
+
+    @property
+    def duration(self):
+        return self._tensors[self._sr].shape[-1] / self._sr
+
+    def resample(self, sr):
+        if self._sr not in self._views:
+            self._load()
+        return super().resample(sr)
+
+    @property
+    def content_hash(self):
+        """sha1 of the samples and sampling rate, needs the host copy."""
+        if self._sr not in self._views:
+            self._load()
+        return ArrayAudio.content_hash.fget(self)
+
+    def tensor(self, sr):
+        """Waveform at sampling rate sr, on the device of the input tensor.
+        Resampled with torchaudio when it is installed (close to, not
+        bitwise equal to the librosa views), through the host otherwise."""
+        if sr not in self._tensors:
+            try:
+                from torchaudio.functional import resample
+                self._tensors[sr] = resample(self._tensors[self._sr], self._sr, sr)
+            except ImportError:
+                import torch
+                self._tensors[sr] = torch.from_numpy(self.resample(sr)).to(
+                    self._tensors[self._sr].device)
+        return self._tensors[sr]
+
+
+class TrimmedAudio(Audio):
+    """Audio between start and end seconds of another Audio.
+    Views are zero copy slices of the views of the untrimmed audio, path is
+    kept (results still name the file), the content hash covers the bounds.
+    """
+
+    def __init__(self, audio, start, end):
+        super().__init__(audio.path)
+        self.audio = audio
+        self.start = start
+        self.end = end
+
+    @property
+    def sr(self):
+        return self.audio.sr
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha1(
+                f'{self.audio.content_hash}:{self.start!r}:{self.end!r}'.encode('utf-8')).hexdigest()
+        return self._content_hash
+
+    def resample(self, sr):
+        if sr not in self._views:
+            self._views[sr] = self.audio.resample(sr)[int(round(self.start * sr)):int(round(self.end * sr))]
+        return self._views[sr]
+
+
+def as_audio(audio, sr=None, name=None):
+    """Audio of a path, an Audio, a numpy array or a torch tensor (arrays need sr)."""
+    if isinstance(audio, Audio):
+        return audio
+    if isinstance(audio, str):
+        return Audio(audio)
+    # torch is only imported by callers passing tensors
+    if type(audio).__module__.startswith('torch'):
+        return TensorAudio(audio, sr, name)
+    return ArrayAudio(audio, sr, name)
+
+
+class AudioPair:
+    """Reference and synthesized audio of one evaluation row.
+    ref: path or Audio of the ground truth audio.
+    deg: path or Audio of the synthesized audio.
+    """
+
+    def __init__(self, ref, deg):
+        self.ref = ref if isinstance(ref, Audio) else Audio(ref)
+        self.deg = deg if isinstance(deg, Audio) else Audio(deg)
+
+    def decode(self, *srs):
+        """Decode both files and compute their views at the sampling rates `srs` up front.
+        Tensors are resampled on their device, the host copy is left to the
+        first metric reading it."""
+        for audio in (self.ref, self.deg):
+            for sr in srs:
+                if isinstance(audio, TensorAudio):
+                    audio.tensor(sr)
+                else:
+                    audio.resample(sr)
@@ -0,0 +1,151 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import fcntl
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+
+# bump to invalidate every entry written by older feature code
+CACHE_VERSION = 1
+# size of the entries, and the lock guarding it, shared by the processes using a cache dir
+SIZE_FILE = 'size'
+LOCK_FILE = '.lock'
+
+
+class FeatureCache:
+    """Persistent, size bounded cache of per-file features and model outputs.
+    Entries are .npy files (loaded memory-mapped) named by a hash of the
+    audio content, the feature name and its extraction parameters, so any
+    parameter change maps to new entries. The least recently used entries
+    are evicted once the cache grows over max_bytes.
+    The size of the entries is kept in a lock protected file of cache_dir,
+    so the budget holds across the processes (pool workers, service) sharing
+    the directory, which is only scanned when that file is missing and on
+    eviction. Only the settings are pickled to the workers.
+    cache_dir: directory holding the entries, shared by runs and processes.
+    max_bytes: size budget of the cache directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, audio, name, params):
+        entry = json.dumps(
+            {'audio': audio.content_hash, 'name': name, 'params': params, 'version': CACHE_VERSION},
+            sort_keys=True
+        )
+        digest = hashlib.sha1(entry.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.npy')
+
+    def get(self, audio, name, params):
+        """Cached array of feature `name` of `audio`, None on a miss."""
+        path = self._path(audio, name, params)
+        try:
+            value = np.load(path, mmap_mode='r')
+            # mtime is the recency used by eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def put(self, audio, name, params, value):
+        path = self._path(audio, name, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, concurrent readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fout:
+            np.save(fout, np.asarray(value))
+        os.replace(tmp_path, path)
+        self._add_size(os.path.getsize(path))
+
+    def fetch(self, audio, name, params, compute):
+        """Cached feature, computed by compute() and stored on a miss."""
+        value = self.get(audio, name, params)
+        if value is None:
+            value = compute()
+            self.put(audio, name, params, value)
+        return value
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.cache_dir, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _add_size(self, nbytes):
+        """Add a new entry of nbytes to the shared size, evicting over the budget."""
+        size_path = os.path.join(self.cache_dir, SIZE_FILE)
+        with self._locked():
+            try:
+                with open(size_path, 'r') as fin:
+                    size = int(fin.read()) + nbytes
+            except (OSError, ValueError):
+                # first put on this directory, or a size file cut short by a crash
+                size = self._scan()[1]
+            if size > self.max_bytes:
+                size = self._evict()
+            with open(size_path, 'w') as fout:
+                fout.write(str(size))
+
+    def _scan(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith('.npy'):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries, sum(entry[1] for entry in entries)
+
+    def _evict(self):
+        """Drop the oldest entries down to 90% of the budget, returns the new size."""
+        entries, total = self._scan()
+        for _, size, path in sorted(entries):
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        return total
+
+
+def memo_key(name, params):
+    """Key of feature `name` in the audio.features memo."""
+    return json.dumps({'name': name, 'params': params}, sort_keys=True)
+
+
+def cached(cache, audio, name, params, compute):
+    """compute() memoised on the audio object (shared by the rows of several
+    systems scored against the same reference) and in cache when given."""
+    key = memo_key(name, params)
+    if key not in audio.features:
+        if cache is None:
+            audio.features[key] = compute()
+        else:
+            audio.features[key] = cache.fetch(audio, name, params, compute)
+    return audio.features[key]
@@ -0,0 +1,173 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from evaluation.cache import FeatureCache
+from evaluation.f0 import F0_BACKENDS
+
+
+def add_scoring_args(parser):
+    """Options of the metrics and models shared by main.py and serve.py."""
+    parser.add_argument(
+        "--lang",
+        type=str,
+        default=None,
+        help="language of the text, choose between zh and en, required by wer and cos_sim"
+    )
+    parser.add_argument(
+        "--f0_backend",
+        type=str,
+        default='parselmouth',
+        help="f0 extractor of f0_rmse, choose between parselmouth, yin (numpy) and torch"
+    )
+    parser.add_argument(
+        "--vad",
+        action="store_true",
+        help="trim the leading and trailing silence of every wav (energy based) before all metrics"
+    )
+    parser.add_argument(
+        "--vad_top_db",
+        type=float,
+        default=40.0,
+        help="frames this far below the loudest frame of a wav count as silence"
+    )
+    parser.add_argument(
+        "--vad_margin_ms",
+        type=float,
+        default=100.0,
+        help="silence kept before and after the speech"
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default='cuda',
+        help="choose cuda"
+    )
+    parser.add_argument(
+        "--sim_model",
+        type=str,
+        default='eres2net',
+        help="choose between eres2net and wavlm"
+    )
+    parser.add_argument(
+        "--utmos_model_dir",
+        type=str,
+        default=None,
+        help="local SpeechMOS checkout with the utmos22_strong checkpoint, "
+             "load UTMOS from torch hub if not set"
+    )
+    parser.add_argument(
+        "--asr_model",
+        type=str,
+        default=None,
+        help="asr model, e.g. a faster-whisper size (large-v3, medium, distil-large-v3) "
+             "for en, defaults to large-v3 for en and paraformer-zh for zh"
+    )
+    parser.add_argument(
+        "--asr_compute_type",
+        type=str,
+        default="default",
+        help="faster-whisper compute type, e.g. int8, int8_float16, float16"
+    )
+    parser.add_argument(
+        "--asr_cpu_threads",
+        type=int,
+        default=0,
+        help="faster-whisper threads on cpu, 0 uses the ctranslate2 default"
+    )
+    parser.add_argument(
+        "--asr_num_workers",
+        type=int,
+        default=1,
+        help="faster-whisper model replicas"
+    )
+    parser.add_argument(
+        "--asr_batched",
+        action="store_true",
+        help="transcribe clips over 30 s with faster-whisper's batched inference pipeline"
+    )
+    parser.add_argument(
+        "--asr_fast_path",
+        action="store_true",
+        help="decode clips up to 30 s batched across files, without VAD or temperature fallback, "
+             "instead of transcribing every clip with VAD, one file at a time"
+    )
+    parser.add_argument(
+        "--asr_text_max_length",
+        action="store_true",
+        help="with --asr_fast_path, bound the whisper decode length by the word count of the reference text"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="number of utterances per forward pass of the neural models, "
+             "UTMOS only batches utterances of equal length since it has no padding mask"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="directory caching reference features across runs, disabled if not set"
+    )
+    parser.add_argument(
+        "--cache_size_gb",
+        type=float,
+        default=10,
+        help="size budget of --cache_dir, least recently used entries are evicted beyond it"
+    )
+    parser.add_argument(
+        "--hyp_file",
+        type=str,
+        default=None,
+        help="jsonl sidecar storing the ASR hypotheses, reused by later runs "
+             "with the same audio and ASR settings and by rescore.py"
+    )
+
+
+def check_scoring_args(args, metric_names=None):
+    """Validate the add_scoring_args options. --lang is required when
+    metric_names holds wer or cos_sim, or when they are not known yet."""
+    assert args.sim_model in ['eres2net', 'wavlm']
+    assert args.f0_backend in F0_BACKENDS
+    assert args.batch_size >= 1
+    if metric_names is not None and 'wer' not in metric_names and 'cos_sim' not in metric_names:
+        assert args.lang in [None, 'zh', 'en']
+    else:
+        assert args.lang in ['zh', 'en'], '--lang (zh or en) is required by wer and cos_sim'
+
+
+def metric_options(args):
+    options = {'f0_backend': args.f0_backend}
+    if args.vad:
+        options['vad'] = {'top_db': args.vad_top_db, 'margin_ms': args.vad_margin_ms}
+    return options
+
+
+def asr_options(args):
+    return {
+        'model': args.asr_model,
+        'compute_type': args.asr_compute_type,
+        'cpu_threads': args.asr_cpu_threads,
+        'num_workers': args.asr_num_workers,
+        'batched': args.asr_batched,
+        'fast_path': args.asr_fast_path,
+        'text_max_length': args.asr_text_max_length,
+    }
+
+
+def open_cache(args):
+    """FeatureCache of --cache_dir, None if not set."""
+    if args.cache_dir is None:
+        return None
+    return FeatureCache(args.cache_dir, max_bytes=int(args.cache_size_gb * 1024 ** 3))
@@ -0,0 +1,118 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# half width of the Sakoe-Chiba band in frames (1 s of 10 ms frames). A fixed
+# radius keeps the band, and so time and memory, linear in the sequence length.
+DTW_RADIUS = 100
+
+
+def _band_windows(n, m, radius):
+    """Column window [lo, hi) of every row of an n x m Sakoe-Chiba band.
+    The band follows the straight line from (0, 0) to (n - 1, m - 1) and is
+    at least as wide as its slope so that consecutive rows stay connected.
+    """
+    slope = (m - 1) / (n - 1) if n > 1 else 0.0
+    if radius is None:
+        radius = max(n, m)
+    radius = max(radius, slope, 1.0)
+    centre = np.arange(n) * slope
+    lo = np.clip(np.floor(centre - radius), 0, m - 1).astype(np.int64)
+    hi = np.clip(np.ceil(centre + radius) + 1, 1, m).astype(np.int64)
+    lo[0] = 0
+    hi[-1] = m
+    return lo, hi
+
+
+def _band_cost(x, y, lo, width):
+    """Euclidean distance of every band cell of the rows x as an (len(x), width) array.
+    Cell (i, k) holds the distance of x[i] and y[lo[i] + k], columns past the
+    end of y are left as garbage and masked by the caller.
+    """
+    cols = np.minimum(lo[:, None] + np.arange(width), len(y) - 1)
+    if x.shape[1] == 1:
+        return np.abs(x[:, :1] - y[cols, 0])
+    # |x - y|^2 = |x|^2 + |y|^2 - 2 x.y, one matmul for the rows
+    first = cols.min()
+    dots = x @ y[first:cols.max() + 1].T
+    dots = np.take_along_axis(dots, cols - first, axis=1)
+    cost = np.square(x).sum(-1)[:, None] + np.square(y).sum(-1)[cols] - 2 * dots
+    return np.sqrt(np.maximum(cost, 0))
+
+
+def dtw_path(x, y, radius=DTW_RADIUS, block=256):
+    """Dynamic time warping between two feature sequences inside a Sakoe-Chiba band.
+    x: numpy array of shape (n,) or (n, dim).
+    y: numpy array of shape (m,) or (m, dim).
+    radius: half width of the band in frames, widened to the slope m / n when
+        that is larger, None gives full DTW.
+    block: rows of local costs computed at a time.
+    Only the step taken into every band cell is kept, as an (n, band width)
+    int8 array, the costs live for one block of rows, so memory is
+    O(n * (radius + m / n)).
+    Returns:
+        cost: accumulated euclidean cost of the optimal path.
+        path: int array of shape (length, 2) with aligned (x, y) indices from start to end.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    if y.ndim == 1:
+        y = y[:, None]
+    n, m = len(x), len(y)
+    lo, hi = _band_windows(n, m, radius)
+    length = hi - lo
+    width = int(length.max())
+
+    # accumulated cost, row by row. Inside a row
+    # D[j] = c[j] + min(a[j], D[j - 1]) with a[j] = min(D_prev[j - 1], D_prev[j])
+    # unrolls to D[j] = C[j] + min_{k <= j}(a[k] - C[k - 1]) with C = cumsum(c),
+    # which is a single minimum.accumulate.
+    # row[k + 1] holds cell (i, lo[i] + k), everything outside the band is
+    # inf, so the previous row is read with plain slices shifted by the window move.
+    # steps[i, k] is the move into cell (i, lo[i] + k): 0 diagonal, 1 up, 2 left,
+    # ties prefer the diagonal.
+    shift = np.diff(lo, prepend=0)
+    steps = np.full((n, width), 2, dtype=np.int8)
+    row = np.full(width + 2 + int(shift.max()), np.inf)
+    for start in range(0, n, block):
+        cost = _band_cost(x[start:start + block], y, lo[start:start + block], width)
+        for i in range(start, min(start + block, n)):
+            row_cost = cost[i - start, :length[i]]
+            csum = np.cumsum(row_cost)
+            if i == 0:
+                acc = csum
+            else:
+                up = row[shift[i] + 1:shift[i] + 1 + length[i]]
+                diag = row[shift[i]:shift[i] + length[i]]
+                acc = csum + np.minimum.accumulate(np.minimum(up, diag) - (csum - row_cost))
+                left = np.concatenate([[np.inf], acc[:-1]])
+                steps[i, :length[i]] = np.argmin(np.stack([diag, up, left]), axis=0)
+            row = np.full(len(row), np.inf)
+            row[1:length[i] + 1] = acc
+
+    # backtrack from the last cell
+    i, j = n - 1, m - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        step = steps[i, j - lo[i]]
+        if step != 2:
+            i -= 1
+        if step != 1:
+            j -= 1
+        path.append((i, j))
+    path = np.array(path[::-1], dtype=np.int64)
+    return float(row[m - lo[n - 1]]), path
@@ -0,0 +1,95 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from evaluation.audio import AudioPair, as_audio
+from evaluation.metrics import METRICS, ModelHub, default_builders, parse_metrics, score_pairs
+
+
+def _split_batch(wavs, lengths=None):
+    """List of waveforms of wavs, a list or a padded (batch, samples) array or tensor."""
+    if isinstance(wavs, (list, tuple)):
+        return list(wavs)
+    if len(wavs.shape) == 1:
+        return [wavs]
+    if lengths is None:
+        return [wav for wav in wavs]
+    return [wav[:int(length)] for wav, length in zip(wavs, lengths)]
+
+
+class Evaluator:
+    """In-process scoring of waveforms, e.g. inside a training loop, without
+    writing wav files. The models are built on first use and kept.
+    Torch tensors stay on their device for UTMOS and the wavlm speaker model
+    when those run on the same device, ASR, eres2net and the CPU metrics read
+    a host copy made once per waveform.
+
+    evaluator = Evaluator(lang='en', device='cuda')
+    results = evaluator.score(gen_batch, 24000, ref_batch, texts, metrics='utmos,cos_sim')
+    """
+
+    def __init__(self, lang='en', device='cuda', sim_model='eres2net', utmos_model_dir=None,
+                 cache=None, method='cut', batch_size=1, options=None, asr_options=None):
+        assert lang in ['zh', 'en']
+        assert method in ['cut', 'dtw']
+        self.models = ModelHub(default_builders(
+            lang, device, sim_model, utmos_model_dir, cache, asr_options=asr_options))
+        self.cache = cache
+        self.method = method
+        self.batch_size = batch_size
+        self.options = options or {}
+
+    def score(self, wavs, sample_rate, refs, texts=None, metrics=None, ref_sample_rate=None,
+              keys=None, lengths=None, ref_lengths=None):
+        """Score synthesized waveforms against their references.
+        wavs, refs: lists of 1-d numpy arrays or torch tensors, or padded
+                    (batch, samples) batches with the valid lengths in
+                    lengths / ref_lengths. refs may also be file paths, or a
+                    single reference shared by every wav.
+        sample_rate, ref_sample_rate: sampling rates, refs default to sample_rate.
+        texts: target texts, needed by wer.
+        metrics: comma separated names or a list, all metrics by default.
+        Returns one dict per wav: key, a value (None on failure) for every
+        requested field, and the errors of the failed metrics.
+        """
+        if metrics is None:
+            metrics = ','.join(METRICS)
+        elif isinstance(metrics, (list, tuple)):
+            metrics = ','.join(metrics)
+        metric_names = parse_metrics(metrics)
+        wavs = _split_batch(wavs, lengths)
+        if isinstance(refs, str) or len(getattr(refs, 'shape', (0, 0))) == 1:
+            refs = [refs] * len(wavs)
+        else:
+            refs = _split_batch(refs, ref_lengths)
+        assert len(refs) == len(wavs), f'{len(wavs)} wavs but {len(refs)} references'
+        if texts is None:
+            assert 'wer' not in metric_names, 'wer needs the texts'
+            texts = [''] * len(wavs)
+        if keys is None:
+            keys = [str(i) for i in range(len(wavs))]
+        ref_sample_rate = ref_sample_rate or sample_rate
+        # a reference shared by several wavs is decoded (and embedded) once
+        ref_audios = {}
+        audio_pairs = []
+        for key, wav, ref in zip(keys, wavs, refs):
+            if id(ref) not in ref_audios:
+                ref_audios[id(ref)] = as_audio(ref, ref_sample_rate)
+            audio_pairs.append(AudioPair(ref_audios[id(ref)], as_audio(wav, sample_rate, key)))
+        scores = score_pairs(
+            audio_pairs, list(texts), metric_names, self.models, self.method,
+            self.batch_size, self.cache, self.options)
+        results = []
+        for key, score in zip(keys, scores):
+            results.append({'key': key, **score['fields'], 'errors': score['errors']})
+        return results
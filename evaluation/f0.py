@@ -0,0 +1,214 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import numpy as np
+from evaluation.utils import JsonHParams, get_f0_features_using_parselmouth
+
+F0_BACKENDS = ['parselmouth', 'yin', 'torch']
+# yin: frames whose cumulative mean normalized difference never drops below
+# this are unvoiced
+YIN_THRESHOLD = 0.15
+# torch: voicing threshold on the normalized autocorrelation peak, as given
+# to praat, and frames quieter than this fraction of the utterance peak are silent
+AC_VOICING_THRESHOLD = 0.6
+AC_SILENCE_THRESHOLD = 0.03
+AC_PERIODS_PER_WINDOW = 3
+# torch: candidates per frame and costs of the path finder, the defaults of
+# praat's To Pitch (ac) that parselmouth uses
+AC_MAX_CANDIDATES = 15
+AC_OCTAVE_COST = 0.01
+AC_OCTAVE_JUMP_COST = 0.35
+AC_VOICED_UNVOICED_COST = 0.14
+
+
+def _frame(wav, frame_length, hop_length):
+    """Frames of wav centred every hop_length samples, as a (n_frames, frame_length) view."""
+    n_frames = 1 + len(wav) // hop_length
+    pad = frame_length // 2
+    padded = np.pad(wav, (pad, pad + frame_length))
+    frames = np.lib.stride_tricks.sliding_window_view(padded, frame_length)
+    return frames[:n_frames * hop_length:hop_length]
+
+
+def _parabolic(values, index):
+    """Sub-sample offset of the extremum of values around index, per row."""
+    rows = np.arange(len(index))
+    left = values[rows, np.maximum(index - 1, 0)]
+    centre = values[rows, index]
+    right = values[rows, np.minimum(index + 1, values.shape[1] - 1)]
+    denom = left - 2 * centre + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / denom, 0.0)
+    return np.clip(offset, -1, 1)
+
+
+def yin_f0(wav, sample_rate, hop_length, f0_min, f0_max, threshold=YIN_THRESHOLD):
+    """YIN pitch of one waveform, every frame at once.
+    Returns the f0 of every frame in Hz, 0 for unvoiced frames.
+    """
+    tau_min = max(int(sample_rate / f0_max), 1)
+    tau_max = int(math.ceil(sample_rate / f0_min))
+    window = tau_max
+    frames = _frame(np.asarray(wav, dtype=np.float64), window + tau_max + 1, hop_length)
+
+    # d(tau) = sum_j (x_j - x_{j+tau})^2 over the first `window` samples,
+    # = e(0) + e(tau) - 2 r(tau) with r the cross correlation from one fft
+    n_fft = 1 << int(math.ceil(math.log2(frames.shape[1] + window)))
+    spec = np.fft.rfft(frames, n_fft)
+    spec_head = np.fft.rfft(frames[:, :window], n_fft)
+    corr = np.fft.irfft(np.conj(spec_head) * spec, n_fft)[:, :tau_max + 1]
+    energy = np.cumsum(np.square(frames), axis=1)
+    energy = np.concatenate([np.zeros((len(frames), 1)), energy], axis=1)
+    taus = np.arange(tau_max + 1)
+    diff = energy[:, [window]] + energy[:, taus + window] - energy[:, taus] - 2 * corr
+    diff = np.maximum(diff, 0)
+
+    # cumulative mean normalized difference
+    cum = np.cumsum(diff[:, 1:], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cmnd = diff[:, 1:] * taus[1:] / cum
+    cmnd = np.concatenate([np.ones((len(frames), 1)), cmnd], axis=1)
+    cmnd = np.nan_to_num(cmnd, nan=1.0, posinf=1.0)
+
+    # first dip under the threshold, at its local minimum
+    search = cmnd[:, tau_min:tau_max]
+    dips = (search < threshold) & (search <= cmnd[:, tau_min + 1:tau_max + 1])
+    voiced = dips.any(axis=1)
+    tau = np.argmax(dips, axis=1) + tau_min
+    tau = tau + _parabolic(cmnd, tau)
+    return np.where(voiced, sample_rate / tau, 0.0)
+
+
+def viterbi_pitch(f0, strength, unvoiced_strength, time_step):
+    """Praat's path finder over the pitch candidates of one waveform.
+    f0, strength: (n_frames, n_candidates) candidate frequencies and strengths,
+                  -inf strength for missing candidates.
+    unvoiced_strength: (n_frames,) strength of the unvoiced candidate.
+    Octave jumps and voicing changes between frames are penalised, which
+    removes the isolated octave errors of picking the best peak per frame.
+    Returns the f0 of every frame, 0 for unvoiced frames.
+    """
+    # state 0 is unvoiced, costs are per 10 ms as in praat
+    f0 = np.concatenate([np.zeros((len(f0), 1)), f0], axis=1)
+    strength = np.concatenate([unvoiced_strength[:, None], strength], axis=1)
+    time_correction = 0.01 / time_step
+    voiced = f0 > 0
+    log_f0 = np.log2(np.where(voiced, f0, 1.0))
+
+    delta = strength[0]
+    back = np.zeros(f0.shape, dtype=np.int64)
+    for t in range(1, len(f0)):
+        # cost[i, j] of the move from candidate i of frame t - 1 to candidate j of frame t
+        jump = AC_OCTAVE_JUMP_COST * np.abs(log_f0[t - 1][:, None] - log_f0[t][None, :])
+        cost = np.where(
+            voiced[t - 1][:, None] & voiced[t][None, :], jump,
+            np.where(voiced[t - 1][:, None] != voiced[t][None, :], AC_VOICED_UNVOICED_COST, 0.0))
+        score = delta[:, None] - time_correction * cost
+        back[t] = np.argmax(score, axis=0)
+        delta = strength[t] + score[back[t], np.arange(f0.shape[1])]
+
+    path = np.empty(len(f0), dtype=np.int64)
+    path[-1] = np.argmax(delta)
+    for t in range(len(f0) - 1, 0, -1):
+        path[t - 1] = back[t, path[t]]
+    return f0[np.arange(len(f0)), path]
+
+
+def torch_autocorrelation_f0(wavs, sample_rate, hop_length, f0_min, f0_max,
+                             voicing_threshold=AC_VOICING_THRESHOLD, device='cpu'):
+    """Autocorrelation pitch of a batch of waveforms, in one padded torch call.
+    The normalized autocorrelation of every hann windowed frame is divided by
+    the one of the window (Boersma, 1993), its highest peaks between f0_max
+    and f0_min are the candidates of the frame, and viterbi_pitch picks one
+    per frame (or unvoiced) with praat's costs, so the contours are
+    comparable to the parselmouth backend.
+    Returns a list with the f0 of every frame of every waveform, 0 for unvoiced frames.
+    """
+    import torch
+
+    lag_min = max(int(sample_rate / f0_max), 1)
+    lag_max = int(math.ceil(sample_rate / f0_min))
+    frame_length = int(AC_PERIODS_PER_WINDOW * sample_rate / f0_min)
+    n_fft = 1 << int(math.ceil(math.log2(2 * frame_length)))
+    lengths = [len(wav) for wav in wavs]
+    n_frames = [1 + length // hop_length for length in lengths]
+
+    batch = torch.zeros(len(wavs), max(lengths) + 2 * frame_length)
+    for i, wav in enumerate(wavs):
+        batch[i, frame_length // 2:frame_length // 2 + len(wav)] = torch.as_tensor(wav)
+    batch = batch.to(device)
+    # (batch, frames, frame_length)
+    frames = batch.unfold(1, frame_length, hop_length)[:, :max(n_frames)]
+    frames = frames - frames.mean(-1, keepdim=True)
+    hann = torch.hann_window(frame_length, periodic=False, device=device)
+    # |X|^2 from the real and imaginary parts, complex abs is slow on cpu
+    power = torch.view_as_real(torch.fft.rfft(frames * hann, n_fft)).square().sum(-1)
+    ac = torch.fft.irfft(power, n_fft)[..., :lag_max + 2]
+    window_power = torch.view_as_real(torch.fft.rfft(hann, n_fft)).square().sum(-1)
+    ac_window = torch.fft.irfft(window_power, n_fft)[:lag_max + 2]
+    ac = ac / ac[..., :1].clamp_min(1e-12) / (ac_window / ac_window[0])
+
+    # local maxima between lag_min and lag_max, the strongest ones are the candidates
+    search = ac[..., lag_min:lag_max + 1]
+    is_peak = (search > ac[..., lag_min - 1:lag_max]) & (search >= ac[..., lag_min + 1:lag_max + 2])
+    search = torch.where(is_peak, search, torch.full_like(search, -math.inf))
+    peak, lag = search.topk(min(AC_MAX_CANDIDATES, search.shape[-1]), dim=-1)
+    lag = lag + lag_min
+    peak_amp = torch.maximum(frames.amax(-1), -frames.amin(-1))
+    utt_amp = torch.maximum(batch.amax(-1), -batch.amin(-1))[:, None].clamp_min(1e-12)
+    # praat: quiet frames favour unvoiced, whatever their periodicity
+    unvoiced = voicing_threshold + torch.clamp(
+        2 - (peak_amp / utt_amp) / (AC_SILENCE_THRESHOLD / (1 + voicing_threshold)), min=0)
+
+    ac = ac.cpu().numpy()
+    peak = peak.cpu().numpy()
+    lag = lag.cpu().numpy()
+    unvoiced = unvoiced.cpu().numpy()
+    f0s = []
+    for i, count in enumerate(n_frames):
+        period = np.stack([
+            lag[i, :count, k] + _parabolic(-ac[i, :count], lag[i, :count, k])
+            for k in range(lag.shape[-1])
+        ], axis=1)
+        f0 = sample_rate / period
+        strength = peak[i, :count] - AC_OCTAVE_COST * np.log2(f0_min / f0)
+        f0s.append(viterbi_pitch(f0, strength, unvoiced[i, :count], hop_length / sample_rate))
+    return f0s
+
+
+def extract_f0(wav, sample_rate, hop_length=256, f0_min=50, f0_max=1100, backend='parselmouth'):
+    """F0 contour of one waveform in Hz, 0 for unvoiced frames.
+    backend: parselmouth (praat autocorrelation), yin (numpy) or torch (autocorrelation).
+    """
+    return extract_f0_batch([wav], sample_rate, hop_length, f0_min, f0_max, backend)[0]
+
+
+def extract_f0_batch(wavs, sample_rate, hop_length=256, f0_min=50, f0_max=1100,
+                     backend='parselmouth', device='cpu'):
+    """F0 contours of a list of waveforms sharing sample_rate.
+    The torch backend processes the whole list in one batched call.
+    """
+    if backend == 'parselmouth':
+        cfg = JsonHParams()
+        cfg.sample_rate = sample_rate
+        cfg.hop_size = hop_length
+        cfg.f0_min = f0_min
+        cfg.f0_max = f0_max
+        return [get_f0_features_using_parselmouth(wav, cfg) for wav in wavs]
+    if backend == 'yin':
+        return [yin_f0(wav, sample_rate, hop_length, f0_min, f0_max) for wav in wavs]
+    if backend == 'torch':
+        return torch_autocorrelation_f0(wavs, sample_rate, hop_length, f0_min, f0_max, device=device)
+    raise ValueError(f'unknown f0 backend {backend}, choose from {",".join(F0_BACKENDS)}')
@@ -13,74 +13,94 @@
 # limitations under the License.
 
 import math
-import torch
-import librosa
 import numpy as np
-from evaluation.utils import (
-    JsonHParams,
-    get_f0_features_using_parselmouth,
-    get_pitch_sub_median)
+from evaluation.audio import SR_22K
+from evaluation.cache import cached, memo_key
+from evaluation.dtw import dtw_path
+from evaluation.f0 import extract_f0, extract_f0_batch
+from evaluation.utils import get_pitch_sub_median
 
 ZERO = 1e-8
 
 
+def _f0_params(backend, hop_length, f0_min, f0_max):
+    return {
+        'backend': backend,
+        'sample_rate': SR_22K,
+        'hop_size': hop_length,
+        'f0_min': f0_min,
+        'f0_max': f0_max,
+    }
+
+
+def prefetch_f0(audio_pairs, hop_length=256, f0_min=50, f0_max=1100, cache=None,
+                backend='parselmouth'):
+    """Extract the f0 of every audio of audio_pairs that extract_f0rmse would
+    compute (not memoised, nor in cache for the references) in one
+    extract_f0_batch call, and memoise it where extract_f0rmse reads it.
+    Worth it for the torch backend, which processes the whole batch at once.
+    """
+    f0_params = _f0_params(backend, hop_length, f0_min, f0_max)
+    key = memo_key('f0', f0_params)
+    missing = {}
+    for audio_pair in audio_pairs:
+        for audio, audio_cache in ((audio_pair.ref, cache), (audio_pair.deg, None)):
+            if id(audio) in missing or key in audio.features:
+                continue
+            if audio_cache is not None and audio_cache.get(audio, 'f0', f0_params) is not None:
+                continue
+            missing[id(audio)] = (audio, audio_cache)
+    missing = list(missing.values())
+    if not missing:
+        return
+    f0s = extract_f0_batch(
+        [audio.resample(SR_22K) for audio, _ in missing], SR_22K, hop_length, f0_min, f0_max,
+        backend)
+    for (audio, audio_cache), f0 in zip(missing, f0s):
+        cached(audio_cache, audio, 'f0', f0_params, lambda: f0)
+
+
 def extract_f0rmse(
-    audio_ref,
-    audio_deg,
+    audio_pair,
     hop_length=256,
     f0_min=50,
     f0_max=1100,
     method='cut',
     need_mean=True,
+    cache=None,
+    backend='parselmouth',
 ):
     """Compute F0 Root Mean Square Error (RMSE) between the predicted and the ground truth audio.
-    audio_ref: path to the ground truth audio.
-    audio_deg: path to the predicted audio.
-    fs: sampling rate.
+    audio_pair: AudioPair of the ground truth and the predicted audio.
     hop_length: hop length.
     f0_min: lower limit for f0.
     f0_max: upper limit for f0.
-    pitch_bin: number of bins for f0 quantization.
-    pitch_max: upper limit for f0 quantization.
-    pitch_min: lower limit for f0 quantization.
     need_mean: subtract the mean value from f0 if "True".
     method: "dtw" will use dtw algorithm to align the length of the ground truth and predicted audio.
             "cut" will cut both audios into a same length according to the one with the shorter length.
+    cache: optional FeatureCache, the reference f0 is read from / stored to it.
+    backend: f0 extractor, parselmouth, yin or torch, see evaluation.f0.
     """
-    # Load audio
-    audio_ref, ref_sr = librosa.load(audio_ref)
-    audio_deg, deg_sr = librosa.load(audio_deg)
-    fs = deg_sr
-    if ref_sr != deg_sr:
-        audio_ref = librosa.resample(audio_ref, orig_sr=ref_sr, target_sr=deg_sr)
-    # Initialize config for f0 extraction
-    cfg = JsonHParams()
-    cfg.sample_rate = fs
-    cfg.hop_size = hop_length
-    cfg.f0_min = f0_min
-    cfg.f0_max = f0_max
-    cfg.pitch_bin = 256
-    cfg.pitch_max = f0_max
-    cfg.pitch_min = f0_min
+    fs = SR_22K
 
-    # Extract f0
-    f0_ref = get_f0_features_using_parselmouth(
-        audio_ref,
-        cfg,
+    # Extract f0, the reference contour is shared by every system evaluated on it,
+    # both contours are memoised so that prefetch_f0 can extract them beforehand
+    f0_params = _f0_params(backend, hop_length, f0_min, f0_max)
+    f0_ref = cached(
+        cache, audio_pair.ref, 'f0', f0_params,
+        lambda: extract_f0(audio_pair.ref.resample(fs), fs, hop_length, f0_min, f0_max, backend)
     )
-
-    f0_deg = get_f0_features_using_parselmouth(
-        audio_deg,
-        cfg,
+    f0_ref = np.array(f0_ref)
+    f0_deg = cached(
+        None, audio_pair.deg, 'f0', f0_params,
+        lambda: extract_f0(audio_pair.deg.resample(fs), fs, hop_length, f0_min, f0_max, backend)
     )
+    f0_deg = np.array(f0_deg)
 
     # Subtract mean value from f0
     if need_mean:
-        f0_ref = torch.from_numpy(f0_ref)
-        f0_deg = torch.from_numpy(f0_deg)
-
-        f0_ref = get_pitch_sub_median(f0_ref).numpy()
-        f0_deg = get_pitch_sub_median(f0_deg).numpy()
+        f0_ref = get_pitch_sub_median(f0_ref)
+        f0_deg = get_pitch_sub_median(f0_deg)
 
     # Avoid silence
     min_length = min(len(f0_ref), len(f0_deg))
@@ -89,21 +109,13 @@ def extract_f0rmse(
 
     # F0 length alignment
     if method == "cut":
-        length = min(len(f0_ref), len(f0_deg))
-        f0_ref = f0_ref[:length]
-        f0_deg = f0_deg[:length]
+        f0_ref = f0_ref[:min_length]
+        f0_deg = f0_deg[:min_length]
     elif method == "dtw":
-        _, wp = librosa.sequence.dtw(f0_ref, f0_deg, backtrack=True)
-        f0_gt_new = []
-        f0_pred_new = []
-        for i in range(wp.shape[0]):
-            gt_index = wp[i][0]
-            pred_index = wp[i][1]
-            f0_gt_new.append(f0_ref[gt_index])
-            f0_pred_new.append(f0_deg[pred_index])
-        f0_ref = np.array(f0_gt_new)
-        f0_deg = np.array(f0_pred_new)
-        assert len(f0_ref) == len(f0_deg)
+        # full dtw, the voiced-only contours of two systems drift apart too much for a band
+        _, wp = dtw_path(f0_ref, f0_deg, radius=None)
+        f0_ref = f0_ref[wp[:, 0]]
+        f0_deg = f0_deg[wp[:, 1]]
 
     # Compute RMSE
     f0_mse = np.square(np.subtract(f0_ref, f0_deg)).mean()
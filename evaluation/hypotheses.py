@@ -0,0 +1,89 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import hashlib
+
+
+def hypothesis_id(content_hash, model_id, decode_params):
+    entry = json.dumps(
+        {'audio': content_hash, 'model': model_id, 'params': decode_params}, sort_keys=True)
+    return hashlib.sha1(entry.encode('utf-8')).hexdigest()
+
+
+class HypothesisStore:
+    """JSONL sidecar of raw ASR hypotheses.
+    Each line holds one hypothesis keyed by the content hash of the audio,
+    the ASR model id and its decoding parameters, so a rerun with the same
+    audio and ASR settings reuses it, while WER can be rescored offline
+    after a reference or normalization change (see rescore.py).
+    path: sidecar file, created if missing and appended to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hyps = {}
+        for entry in self.entries(path):
+            self.hyps[entry['id']] = entry['hyp']
+        self.fout = None
+
+    @staticmethod
+    def entries(path):
+        """Entries of a sidecar file, a line cut short by a crash is skipped."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r') as fin:
+            for line in fin:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def get(self, audio, model_id, decode_params):
+        """Stored hypothesis of audio, None on a miss."""
+        return self.hyps.get(hypothesis_id(audio.content_hash, model_id, decode_params))
+
+    def put(self, audio, model_id, decode_params, hyp):
+        entry_id = hypothesis_id(audio.content_hash, model_id, decode_params)
+        self.hyps[entry_id] = hyp
+        if self.fout is None:
+            self.fout = open(self.path, 'a')
+        self.fout.write(json.dumps({
+            'id': entry_id,
+            'audio': audio.content_hash,
+            'path': audio.path,
+            'model': model_id,
+            'params': decode_params,
+            'hyp': hyp,
+        }, ensure_ascii=False) + '\n')
+        self.fout.flush()
+
+
+def transcribe(asr_model, audios, store=None, batch_size=1, texts=None):
+    """Hypotheses of audios, read from store when present and transcribed
+    (then stored) otherwise. The ASR model only runs on the misses.
+    texts: reference texts of audios, see ASRPipeline.text_max_length."""
+    if store is None:
+        return asr_model.infer_batch(audios, batch_size, texts)
+    hyp_texts = [store.get(audio, asr_model.model_id, asr_model.decode_params) for audio in audios]
+    missing = [i for i, hyp_text in enumerate(hyp_texts) if hyp_text is None]
+    if missing:
+        new_texts = asr_model.infer_batch(
+            [audios[i] for i in missing], batch_size,
+            [texts[i] for i in missing] if texts is not None else None)
+        for i, hyp_text in zip(missing, new_texts):
+            hyp_texts[i] = hyp_text
+            store.put(audios[i], asr_model.model_id, asr_model.decode_params, hyp_text)
+    return hyp_texts
@@ -0,0 +1,174 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
+from evaluation.audio import Audio, AudioPair
+from evaluation.shards import open_shards
+
+
+def parse_wav_dirs(wav_dir, system=None):
+    """System name -> wav directory of a --wav_dir value, either one directory
+    (named system) or comma separated name=directory entries."""
+    if '=' not in wav_dir:
+        return {system: wav_dir}
+    wav_dirs = {}
+    for entry in wav_dir.split(','):
+        if not entry.strip():
+            continue
+        name, _, directory = entry.partition('=')
+        assert name.strip() and directory.strip(), f'expected name=directory, got {entry}'
+        assert name.strip() not in wav_dirs, f'system {name.strip()} given twice'
+        wav_dirs[name.strip()] = directory.strip()
+    return wav_dirs
+
+
+def shard_name(key, system=None):
+    """Name of a synthesized wav in the shard index, prefixed by its system if any."""
+    return key if system is None else f'{system}/{key}'
+
+
+class AudioLoader:
+    """Builds the AudioPair of an input row from packed shards or loose files.
+    wav_dir: directory of the synthesized wavs, named {key}.wav, or a dict
+             of system name -> directory, the directory of a row is the one
+             of its 'system' field.
+    shard_dir: optional directory packed by pack.py, rows (or references)
+               missing from it are read from their loose files.
+    The loader only holds the directories, so it is cheap to send to
+    worker processes, each of which maps the shards once.
+    """
+
+    def __init__(self, wav_dir, shard_dir=None):
+        self.wav_dirs = wav_dir if isinstance(wav_dir, dict) else {None: wav_dir}
+        self.shard_dir = shard_dir
+
+    def deg_path(self, row):
+        return f'{self.wav_dirs[row.get("system")]}/{row["key"]}.wav'
+
+    def ref(self, row):
+        ref = None
+        if self.shard_dir is not None:
+            ref = open_shards(self.shard_dir).get('ref', row['ref_wav'], row['ref_wav'])
+        return ref or Audio(row['ref_wav'])
+
+    def pair(self, row, ref=None):
+        """AudioPair of row, ref: optional Audio of its reference, shared with other rows."""
+        deg_path = self.deg_path(row)
+        deg = None
+        if self.shard_dir is not None:
+            deg = open_shards(self.shard_dir).get(
+                'deg', shard_name(row['key'], row.get('system')), deg_path)
+        return AudioPair(ref or self.ref(row), deg or Audio(deg_path))
+
+    def _duration(self, kind, name, path):
+        if self.shard_dir is not None:
+            entry = open_shards(self.shard_dir).entries[kind].get(name)
+            if entry is not None:
+                return entry[2] / entry[3]
+        try:
+            return sf.info(path).duration
+        except Exception:
+            # unreadable files fail in the metric stage, they cost nothing here
+            return 0.0
+
+    def duration(self, row, systems=(None,)):
+        """Seconds of audio behind an input row: its reference and the
+        synthesized wav of every system, read from the shard index or the
+        file headers, nothing is decoded."""
+        seconds = self._duration('ref', row['ref_wav'], row['ref_wav'])
+        for system in systems:
+            row = {**row, 'system': system}
+            seconds += self._duration('deg', shard_name(row['key'], system), self.deg_path(row))
+        return seconds
+
+    def pairs(self, rows):
+        """AudioPair of every row, rows with the same reference (e.g. the
+        outputs of several systems) share its Audio, so that it is decoded
+        and its features are extracted once."""
+        refs = {}
+        audio_pairs = []
+        for row in rows:
+            if row['ref_wav'] not in refs:
+                refs[row['ref_wav']] = self.ref(row)
+            audio_pairs.append(self.pair(row, refs[row['ref_wav']]))
+        return audio_pairs
+
+
+def _decode(audio, sample_rates):
+    try:
+        for sr in sample_rates:
+            audio.resample(sr)
+    except Exception:
+        # left undecoded, the metric stage decodes it again and records the error
+        pass
+
+
+class Prefetcher:
+    """Decodes and resamples the audio of the next windows of rows in
+    background threads while the current window is being scored.
+    loader: AudioLoader of the rows.
+    windows: list of lists of input rows, iterated in order.
+    sample_rates: views computed ahead for every audio.
+    num_threads: decode threads, decoding and resampling mostly run outside the GIL.
+    max_windows: decoded windows held ahead of the consumer, bounds the memory.
+    Iterating yields the list of AudioPair of every window.
+    """
+
+    def __init__(self, loader, windows, sample_rates, num_threads=2, max_windows=1):
+        self.loader = loader
+        self.windows = windows
+        self.sample_rates = sample_rates
+        self.num_threads = num_threads
+        self.queue = queue.Queue(maxsize=max_windows)
+        self.stop = threading.Event()
+        self.thread = None
+
+    def _produce(self):
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for window_rows in self.windows:
+                try:
+                    item = self.loader.pairs(window_rows)
+                    # shared references are decoded once
+                    audios = {}
+                    for audio_pair in item:
+                        audios[id(audio_pair.ref)] = audio_pair.ref
+                        audios[id(audio_pair.deg)] = audio_pair.deg
+                    list(executor.map(
+                        lambda audio: _decode(audio, self.sample_rates), audios.values()))
+                except Exception as e:
+                    item = e
+                # blocks while the consumer is max_windows behind
+                while not self.stop.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if self.stop.is_set():
+                    return
+
+    def __iter__(self):
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+        try:
+            for _ in self.windows:
+                item = self.queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop.set()
@@ -12,16 +12,97 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from pymcd.mcd import Calculate_MCD
+import math
+import pyworld
+import numpy as np
+from functools import lru_cache
+from evaluation.audio import SR_22K
+from evaluation.cache import cached
+from evaluation.dtw import dtw_path
 
+# analysis settings of pymcd, part of the reference cache key
+MCEP_PARAMS = {
+    'sample_rate': SR_22K,
+    'frame_period': 5.0,
+    'fft_size': 512,
+    'order': 13,
+    'alpha': 0.65,
+}
+LOG_SPEC_DB_CONST = 10.0 / math.log(10.0) * math.sqrt(2.0)
 
-def extract_mcd(audio_ref, audio_deg):
+
+@lru_cache(maxsize=None)
+def get_freqt_matrix(fft_size, order, alpha):
+    """SPTK's freqt (cepstrum -> mel-cepstrum frequency warping) as a matrix.
+    freqt is linear in the input cepstrum, so it is run once on the identity
+    and applied to every frame with a single matmul.
+    """
+    beta = 1 - alpha * alpha
+    c = np.eye(fft_size // 2 + 1)
+    g = np.zeros((fft_size // 2 + 1, order + 1))
+    for i in range(fft_size // 2, -1, -1):
+        d = g.copy()
+        g[:, 0] = c[:, i] + alpha * d[:, 0]
+        g[:, 1] = beta * d[:, 0] + alpha * d[:, 1]
+        for j in range(2, order + 1):
+            g[:, j] = d[:, j - 1] + alpha * (d[:, j] - g[:, j - 1])
+    return g
+
+
+def wav2mcep(wav, sample_rate=SR_22K, frame_period=5.0, fft_size=512, order=13, alpha=0.65):
+    """Mel-cepstra of a waveform as a (frames, order + 1) array.
+    Matches pymcd: WORLD spectral envelope (DIO + StoneMask + CheapTrick, the
+    aperiodicity of pyworld.wav2world is skipped since it is unused) followed by
+    pysptk.mcep(maxiter=0, etype=1, eps=1e-8, itype=3), computed for all frames at once.
+    """
+    wav = wav.astype(np.double)
+    f0, t = pyworld.dio(wav, sample_rate, frame_period=frame_period)
+    f0 = pyworld.stonemask(wav, f0, t, sample_rate)
+    sp = pyworld.cheaptrick(wav, f0, t, sample_rate, fft_size=fft_size)
+
+    # mcep without newton iterations: log periodogram -> cepstrum -> freqt
+    cep = np.fft.irfft(np.log(np.square(sp) + 1.0E-8), n=fft_size)[:, :fft_size // 2 + 1]
+    cep[:, 0] /= 2
+    cep[:, -1] /= 2
+    return cep @ get_freqt_matrix(fft_size, order, alpha)
+
+
+def mcep_distortion(ref_mcep, syn_mcep, mcd_mode='dtw_sl'):
+    """Mean MCD between two mel-cepstra sequences, as pymcd's average_mcd.
+    mcd_mode: "plain" pairs frames one to one (inputs of equal length),
+              "dtw" aligns with dtw over the coefficients without c0,
+              "dtw_sl" is "dtw" scaled by the length ratio of the two sequences.
+    """
+    if mcd_mode == 'plain':
+        length = min(len(ref_mcep), len(syn_mcep))
+        path = np.repeat(np.arange(length)[:, None], 2, axis=1)
+    else:
+        _, path = dtw_path(ref_mcep[:, 1:], syn_mcep[:, 1:])
+    diff = ref_mcep[path[:, 0]] - syn_mcep[path[:, 1]]
+    mean_mcd = LOG_SPEC_DB_CONST * np.sqrt(np.square(diff).sum(-1)).mean()
+    if mcd_mode == 'dtw_sl':
+        mean_mcd *= max(len(ref_mcep), len(syn_mcep)) / min(len(ref_mcep), len(syn_mcep))
+    return float(mean_mcd)
+
+
+def extract_mcd(audio_pair, mcd_mode='dtw_sl', cache=None):
     """Extract Mel-Cepstral Distance for a two given audio.
     Args:
-        audio_ref: The given reference audio. It is an audio path.
-        audio_deg: The given synthesized audio. It is an audio path.
+        audio_pair: AudioPair of the reference and the synthesized audio.
+        mcd_mode: "plain", "dtw" or "dtw_sl", see mcep_distortion.
+        cache: optional FeatureCache, the reference mel-cepstra are read from / stored to it.
     """
-
-    mcd_toolbox = Calculate_MCD(MCD_mode="dtw_sl")
-    mcd_value = mcd_toolbox.calculate_mcd(audio_ref, audio_deg)
-    return mcd_value
+    audio_ref = audio_pair.ref.resample(SR_22K) if mcd_mode == 'plain' else None
+    audio_deg = audio_pair.deg.resample(SR_22K)
+    if mcd_mode == 'plain':
+        # both waveforms are zero padded to the same length before analysis
+        length = max(len(audio_ref), len(audio_deg))
+        ref_mcep = wav2mcep(np.pad(audio_ref, (0, length - len(audio_ref))))
+        audio_deg = np.pad(audio_deg, (0, length - len(audio_deg)))
+    else:
+        ref_mcep = cached(
+            cache, audio_pair.ref, 'mcep', MCEP_PARAMS,
+            lambda: wav2mcep(audio_pair.ref.resample(SR_22K))
+        )
+    syn_mcep = wav2mcep(audio_deg)
+    return mcep_distortion(np.asarray(ref_mcep), syn_mcep, mcd_mode)
@@ -0,0 +1,335 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from evaluation.audio import SR_16K, SR_22K
+from evaluation.pesq import extract_pesq
+from evaluation.f0_rmse import extract_f0rmse, prefetch_f0
+from evaluation.mel_cepstral_distortion import extract_mcd
+from evaluation.profiling import timed
+from evaluation.wer import wer_fields
+from evaluation.hypotheses import HypothesisStore, hypothesis_id, transcribe
+from evaluation.vad import trim_pair
+
+
+class Metric:
+    """Entry of the metric registry.
+    name: metric name, as given to --metrics.
+    model: name of the ModelHub model the metric needs, None for CPU metrics.
+    sample_rates: sampling rates of the audio views the metric reads.
+    aligned: whether the metric depends on the cut/dtw length alignment.
+    compute: CPU metrics, fn(audio_pair, method, cache, options) -> dict of result fields,
+             options is a dict of metric options such as the f0 backend.
+    prepare: optional for CPU metrics, fn(audio_pairs, cache, options) run over
+             the rows of a batch before compute, e.g. to extract their features
+             in one batched call. Its failures are left to compute.
+    compute_batch: model metrics, fn(models, audio_pairs, texts, batch_size)
+                   -> list of dicts of result fields, one per pair.
+    """
+
+    def __init__(self, name, model=None, sample_rates=(), aligned=False,
+                 compute=None, prepare=None, compute_batch=None):
+        self.name = name
+        self.model = model
+        self.sample_rates = sample_rates
+        self.aligned = aligned
+        self.compute = compute
+        self.prepare = prepare
+        self.compute_batch = compute_batch
+
+
+class ModelHub:
+    """Neural models shared by the metrics, each built on first use.
+    builders: dict of model name -> zero argument function building the model.
+    """
+
+    def __init__(self, builders):
+        self.builders = builders
+        self.models = {}
+
+    def get(self, name):
+        if name not in self.models:
+            self.models[name] = self.builders[name]()
+        return self.models[name]
+
+
+def default_builders(lang, device, sim_model='eres2net', utmos_model_dir=None, cache=None,
+                     hyp_file=None, asr_options=None):
+    """Builders of the asr, sv and utmos models for ModelHub, and of the
+    'hypotheses' store of ASR outputs (None when hyp_file is not set).
+    asr_options: extra ASRPipeline arguments (model, compute_type, cpu_threads, ...).
+    The pipelines are imported inside the builders so that torch, faster_whisper,
+    funasr, modelscope and transformers load only when a metric needs them.
+    """
+    def build_asr():
+        from evaluation.asr_pipeline import ASRPipeline
+        return ASRPipeline(lang=lang, device=device, **(asr_options or {}))
+
+    def build_sv():
+        from evaluation.sv_pipeline import SVPipeline
+        return SVPipeline(model=sim_model, lang=lang, device=device, cache=cache)
+
+    def build_utmos():
+        from evaluation.utmos import UTMOSPipeline
+        return UTMOSPipeline(device=device, model_dir=utmos_model_dir, cache=cache)
+
+    def build_hypotheses():
+        return HypothesisStore(hyp_file) if hyp_file is not None else None
+
+    return {
+        'asr': build_asr,
+        'sv': build_sv,
+        'utmos': build_utmos,
+        'hypotheses': build_hypotheses,
+    }
+
+
+def _pesq(audio_pair, method, cache, options):
+    return {'pesq': extract_pesq(audio_pair, method=method)}
+
+
+def _f0_rmse(audio_pair, method, cache, options):
+    backend = options.get('f0_backend', 'parselmouth')
+    return {'f0_rmse': extract_f0rmse(audio_pair, method=method, cache=cache, backend=backend)}
+
+
+def _prepare_f0_rmse(audio_pairs, cache, options):
+    backend = options.get('f0_backend', 'parselmouth')
+    # only the torch backend gains from extracting the batch at once
+    if backend == 'torch':
+        prefetch_f0(audio_pairs, cache=cache, backend=backend)
+
+
+def _mcd(audio_pair, method, cache, options):
+    return {'mcd': extract_mcd(audio_pair, cache=cache)}
+
+
+def _cos_sim(models, audio_pairs, texts, batch_size):
+    cos_sims = models.get('sv').compute_cos_sim_scores(audio_pairs, batch_size=batch_size)
+    return [{'cos_sim': float(cos_sim)} for cos_sim in cos_sims]
+
+
+def _wer(models, audio_pairs, texts, batch_size):
+    asr_model = models.get('asr')
+    hyp_texts = transcribe(
+        asr_model, [audio_pair.deg for audio_pair in audio_pairs],
+        models.get('hypotheses'), batch_size=batch_size, texts=texts)
+    # hyp_id names the sidecar entry of the hypothesis, for rescore.py
+    return [{**wer_fields(asr_model.get_wer(ref_text, hyp_text)),
+             'hyp_id': hypothesis_id(audio_pair.deg.content_hash, asr_model.model_id,
+                                     asr_model.decode_params)}
+            for audio_pair, ref_text, hyp_text in zip(audio_pairs, texts, hyp_texts)]
+
+
+def _utmos(models, audio_pairs, texts, batch_size):
+    utmos_scores = models.get('utmos').compute_utmos_scores(audio_pairs, batch_size=batch_size)
+    return [{'utmos': float(utmos)} for utmos in utmos_scores]
+
+
+# in result field order
+METRICS = {
+    'pesq': Metric('pesq', sample_rates=(SR_16K,), aligned=True, compute=_pesq),
+    'cos_sim': Metric('cos_sim', model='sv', sample_rates=(SR_16K,), compute_batch=_cos_sim),
+    'f0_rmse': Metric('f0_rmse', sample_rates=(SR_22K,), aligned=True, compute=_f0_rmse,
+                      prepare=_prepare_f0_rmse),
+    'wer': Metric('wer', model='asr', sample_rates=(SR_16K,), compute_batch=_wer),
+    'mcd': Metric('mcd', sample_rates=(SR_22K,), compute=_mcd),
+    'utmos': Metric('utmos', model='utmos', sample_rates=(SR_16K,), compute_batch=_utmos),
+}
+
+
+def parse_metrics(metrics):
+    """Metric names of a comma separated --metrics value, in result field order."""
+    names = [name.strip() for name in metrics.split(',') if name.strip()]
+    for name in names:
+        if name not in METRICS:
+            raise ValueError(f'unknown metric {name}, choose from {",".join(METRICS)}')
+    return [name for name in METRICS if name in names]
+
+
+def format_error(e):
+    return f'{type(e).__name__}: {e}'
+
+
+def compute_cpu_metrics(audio_pair, metric_names, method, cache=None, options=None):
+    """CPU metrics of one row, options: dict of metric options (e.g.
+    f0_backend, vad: trim the silence around the speech, see vad.trim_pair).
+    Returns a dict with the result 'fields' of every metric, the 'errors' of
+    the failing ones (recorded instead of raised), the 'timing' of every stage
+    and the 'duration' of the synthesized audio (None when it failed to decode).
+    """
+    return compute_cpu_metrics_batch([audio_pair], metric_names, method, cache, options)[0]
+
+
+def compute_cpu_metrics_batch(audio_pairs, metric_names, method, cache=None, options=None):
+    """CPU metrics of a list of rows, see compute_cpu_metrics. The prepare
+    step of every metric runs once over all of them, then each row is scored.
+    Returns one compute_cpu_metrics dict per row.
+    """
+    metrics = [METRICS[name] for name in metric_names if METRICS[name].model is None]
+    options = options or {}
+    audio_pairs = list(audio_pairs)
+    results = []
+    for i, audio_pair in enumerate(audio_pairs):
+        errors = {}
+        timing = {}
+        duration = None
+        try:
+            with timed([timing], 'decode'):
+                audio_pair.decode(*{sr for metric in metrics for sr in metric.sample_rates})
+            duration = audio_pair.deg.duration
+        except Exception as e:
+            errors['decode'] = format_error(e)
+        if options.get('vad') and metrics:
+            try:
+                with timed([timing], 'vad'):
+                    audio_pairs[i] = trim_pair(audio_pair, options['vad'], cache)
+            except Exception as e:
+                errors['vad'] = format_error(e)
+        results.append({'fields': {}, 'errors': errors, 'timing': timing, 'duration': duration})
+    timings = [result['timing'] for result in results]
+    for metric in metrics:
+        if metric.prepare is None:
+            continue
+        try:
+            with timed(timings, metric.name):
+                metric.prepare(audio_pairs, cache, options)
+        except Exception:
+            # compute extracts what is missing and records the error of its own row
+            pass
+    for audio_pair, result in zip(audio_pairs, results):
+        for metric in metrics:
+            try:
+                with timed([result['timing']], metric.name):
+                    result['fields'][metric.name] = metric.compute(audio_pair, method, cache, options)
+            except Exception as e:
+                result['fields'][metric.name] = {metric.name: None}
+                result['errors'][metric.name] = format_error(e)
+    return results
+
+
+def run_batched(fn, items, errors, name):
+    """Run a batched model call over items.
+    If the batch fails, retry item by item so that a corrupt wav only loses
+    its own output, the failure is recorded in errors[i][name].
+    """
+    try:
+        return fn(items)
+    except Exception:
+        outputs = []
+        for i, item in enumerate(items):
+            try:
+                outputs.append(fn([item])[0])
+            except Exception as e:
+                outputs.append({name: None})
+                errors[i][name] = format_error(e)
+        return outputs
+
+
+def compute_model_metrics(audio_pairs, texts, metric_names, models, batch_size=1, cache=None,
+                          options=None):
+    """Model metrics of a list of rows, each model runs batched over all of them.
+    The rows are trimmed first when options holds vad.
+    Returns per-row lists of result 'fields' (by metric), 'errors', 'timing'
+    and 'duration' of the synthesized audio (None when nothing was decoded).
+    """
+    metrics = [METRICS[name] for name in metric_names if METRICS[name].model is not None]
+    fields = [{} for _ in audio_pairs]
+    errors = [{} for _ in audio_pairs]
+    timings = [{} for _ in audio_pairs]
+    durations = [None for _ in audio_pairs]
+
+    # decode every wav once, all metrics read the shared views
+    sample_rates = {sr for metric in metrics for sr in metric.sample_rates}
+    for i, audio_pair in enumerate(audio_pairs):
+        if not metrics:
+            break
+        try:
+            with timed([timings[i]], 'decode'):
+                audio_pair.decode(*sample_rates)
+            durations[i] = audio_pair.deg.duration
+        except Exception as e:
+            errors[i]['decode'] = format_error(e)
+    vad = (options or {}).get('vad')
+    if vad and metrics:
+        audio_pairs = list(audio_pairs)
+        for i, audio_pair in enumerate(audio_pairs):
+            try:
+                with timed([timings[i]], 'vad'):
+                    audio_pairs[i] = trim_pair(audio_pair, vad, cache)
+            except Exception as e:
+                errors[i]['vad'] = format_error(e)
+
+    # rows that failed to decode or trim stay out of the batches, one corrupt
+    # wav would otherwise send the whole window to the per-row retry
+    valid = [i for i in range(len(audio_pairs)) if 'decode' not in errors[i] and 'vad' not in errors[i]]
+    for metric in metrics:
+        for i in range(len(audio_pairs)):
+            fields[i][metric.name] = {metric.name: None}
+        if not valid:
+            continue
+        valid_errors = [errors[i] for i in valid]
+        with timed([timings[i] for i in valid], metric.name):
+            outputs = run_batched(
+                lambda indices: metric.compute_batch(
+                    models,
+                    [audio_pairs[valid[k]] for k in indices],
+                    [texts[valid[k]] for k in indices],
+                    batch_size
+                ),
+                list(range(len(valid))), valid_errors, metric.name)
+        for i, output in zip(valid, outputs):
+            fields[i][metric.name] = output
+    return {'fields': fields, 'errors': errors, 'timing': timings, 'duration': durations}
+
+
+def score_pairs(audio_pairs, texts, metric_names, models, method, batch_size=1, cache=None,
+                options=None, cpu_futures=None):
+    """Score a list of AudioPair with every metric of metric_names.
+    The model metrics run batched over the whole list, the CPU metrics are
+    computed in process, or read from cpu_futures (one per pair) when they
+    run in a worker pool.
+    Returns one dict per pair with the result 'fields' in registry order
+    (None for failed metrics), the 'errors', the 'timing' of every stage and
+    the 'duration' of the synthesized audio, taken from whichever stage
+    decoded it (None when none did).
+    """
+    model_metrics = compute_model_metrics(
+        audio_pairs, texts, metric_names, models, batch_size, cache, options)
+    if cpu_futures is None:
+        cpu_results = compute_cpu_metrics_batch(audio_pairs, metric_names, method, cache, options)
+    scores = []
+    for i, audio_pair in enumerate(audio_pairs):
+        if cpu_futures is None:
+            cpu_metrics = cpu_results[i]
+        else:
+            try:
+                cpu_metrics = cpu_futures[i].result()
+            except Exception as e:
+                cpu_metrics = {'fields': {}, 'errors': {'cpu_worker': format_error(e)}, 'timing': {},
+                               'duration': None}
+        metric_fields = {**model_metrics['fields'][i], **cpu_metrics['fields']}
+        timing = dict(model_metrics['timing'][i])
+        for stage, seconds in cpu_metrics['timing'].items():
+            timing[stage] = timing.get(stage, 0.0) + seconds
+        fields = {}
+        for name in metric_names:
+            fields.update(metric_fields.get(name, {name: None}))
+        scores.append({
+            'fields': fields,
+            'errors': {**model_metrics['errors'][i], **cpu_metrics['errors']},
+            'timing': timing,
+            'duration': model_metrics['duration'][i] if model_metrics['duration'][i] is not None
+            else cpu_metrics.get('duration'),
+        })
+    return scores
@@ -0,0 +1,53 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+import hashlib
+
+
+def key_hash(key):
+    """Stable 64 bit hash of a row key, the same on every machine and run
+    (unlike hash(), which is salted per process)."""
+    return int.from_bytes(hashlib.sha1(str(key).encode('utf-8')).digest()[:8], 'big')
+
+
+def partition(keys, durations, num_shards):
+    """Shard index of every key, balancing the total duration of the shards.
+    Keys are assigned longest first (ties broken by key hash) to the shard
+    with the least duration so far (ties broken by index), so every node
+    computes the same partition from the same rows, whatever their order.
+    durations: seconds of audio of every key, None hashes keys to shards
+               (balanced by row count only).
+    """
+    if durations is None:
+        return [key_hash(key) % num_shards for key in keys]
+    order = sorted(range(len(keys)), key=lambda i: (-durations[i], key_hash(keys[i]), str(keys[i])))
+    loads = [(0.0, shard) for shard in range(num_shards)]
+    shards = [None] * len(keys)
+    for i in order:
+        load, shard = heapq.heappop(loads)
+        shards[i] = shard
+        heapq.heappush(loads, (load + durations[i], shard))
+    return shards
+
+
+def select_shard(rows, shard_index, num_shards, duration=None):
+    """Rows of shard shard_index out of num_shards, in input order.
+    duration: optional function of a row giving its seconds of audio.
+    """
+    keys = [row['key'] for row in rows]
+    assert len(set(keys)) == len(keys), 'row keys must be unique to be sharded'
+    durations = [duration(row) for row in rows] if duration is not None else None
+    shards = partition(keys, durations, num_shards)
+    return [row for row, shard in zip(rows, shards) if shard == shard_index]
@@ -15,19 +15,41 @@
 import librosa
 import numpy as np
 from pypesq import pesq
+from evaluation.audio import SR_16K
+from evaluation.dtw import dtw_path
 
+# 32 ms windows with a 10 ms hop for the dtw alignment features
+ALIGN_N_FFT = 512
+ALIGN_HOP = 160
 
-def extract_pesq(audio_ref, audio_deg, method):
-    # Load audio
-    audio_ref, ref_sr = librosa.load(audio_ref)
-    audio_deg, deg_sr = librosa.load(audio_deg)
 
-    # Resample
-    if ref_sr != 16000:
-        audio_ref = librosa.resample(audio_ref, orig_sr=ref_sr, target_sr=16000)
-    if deg_sr != 16000:
-        audio_deg = librosa.resample(audio_deg, orig_sr=deg_sr, target_sr=16000)
-    fs = 16000
+def dtw_align(audio_ref, audio_deg, hop_length=ALIGN_HOP):
+    """Align two 16 kHz waveforms by banded DTW over MFCC frames.
+    Every (ref, deg) frame pair of the warping path contributes hop_length
+    samples from each signal, so the aligned signals have equal length.
+    """
+    mfcc_ref = librosa.feature.mfcc(
+        y=audio_ref, sr=SR_16K, n_mfcc=13, n_fft=ALIGN_N_FFT, hop_length=hop_length)
+    mfcc_deg = librosa.feature.mfcc(
+        y=audio_deg, sr=SR_16K, n_mfcc=13, n_fft=ALIGN_N_FFT, hop_length=hop_length)
+    _, wp = dtw_path(mfcc_ref.T, mfcc_deg.T)
+
+    # map frame pairs back to sample indices
+    offsets = np.arange(hop_length)
+    ref_index = np.minimum(wp[:, :1] * hop_length + offsets, len(audio_ref) - 1).ravel()
+    deg_index = np.minimum(wp[:, 1:] * hop_length + offsets, len(audio_deg) - 1).ravel()
+    return audio_ref[ref_index], audio_deg[deg_index]
+
+
+def extract_pesq(audio_pair, method):
+    """Compute PESQ between the reference and the synthesized audio.
+    audio_pair: AudioPair of the ground truth and the predicted audio.
+    method: "dtw" aligns both audios with dtw over frame features.
+            "cut" cuts both audios to the length of the shorter one.
+    """
+    audio_ref = audio_pair.ref.resample(SR_16K)
+    audio_deg = audio_pair.deg.resample(SR_16K)
+    fs = SR_16K
 
     # Audio length alignment
     if len(audio_ref) != len(audio_deg):
@@ -36,16 +58,7 @@ def extract_pesq(audio_ref, audio_deg, method):
             audio_ref = audio_ref[:length]
             audio_deg = audio_deg[:length]
         elif method == "dtw":
-            _, wp = librosa.sequence.dtw(audio_ref, audio_deg, backtrack=True)
-            audio_ref_new = []
-            audio_deg_new = []
-            for i in range(wp.shape[0]):
-                ref_index = wp[i][0]
-                deg_index = wp[i][1]
-                audio_ref_new.append(audio_ref[ref_index])
-                audio_deg_new.append(audio_deg[deg_index])
-            audio_ref = np.array(audio_ref_new)
-            audio_deg = np.array(audio_deg_new)
+            audio_ref, audio_deg = dtw_align(audio_ref, audio_deg)
             assert len(audio_ref) == len(audio_deg)
 
     # Compute pesq
@@ -0,0 +1,94 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import resource
+import numpy as np
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the wall time of the block to timings[i][stage] of every row.
+    timings: list of per-row dicts, a batched stage is split evenly over its rows.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) / max(len(timings), 1)
+        for timing in timings:
+            timing[stage] = timing.get(stage, 0.0) + elapsed
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest finished child, in MB."""
+    # ru_maxrss is in KB on linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+class RunStats:
+    """Per-stage latency and throughput of an evaluation run."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stage_times = defaultdict(list)
+        self.rows = 0
+        self.audio_seconds = 0.0
+
+    def add(self, timing, audio_seconds=0.0):
+        """Record the stage timings of one row and the duration of its synthesized audio."""
+        for stage, seconds in timing.items():
+            self.stage_times[stage].append(seconds)
+        self.rows += 1
+        self.audio_seconds += audio_seconds
+
+    def summary(self):
+        wall = time.perf_counter() - self.start
+        own_rss, child_rss = peak_rss_mb()
+        stages = {}
+        for stage, seconds in self.stage_times.items():
+            p50, p95, p99 = (float(p) for p in np.percentile(seconds, [50, 95, 99]))
+            stages[stage] = {
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'mean': float(np.mean(seconds)),
+                'total': float(np.sum(seconds)),
+            }
+        return {
+            'rows': self.rows,
+            'wall_seconds': wall,
+            'utterances_per_second': self.rows / wall if wall > 0 else 0.0,
+            'audio_seconds_per_second': self.audio_seconds / wall if wall > 0 else 0.0,
+            'peak_rss_mb': own_rss,
+            'peak_worker_rss_mb': child_rss,
+            'stages': stages,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{summary['rows']} rows in {summary['wall_seconds']:.1f} s, "
+              f"{summary['utterances_per_second']:.2f} utt/s, "
+              f"{summary['audio_seconds_per_second']:.2f} audio s/s, "
+              f"peak rss {summary['peak_rss_mb']:.0f} MB "
+              f"(workers {summary['peak_worker_rss_mb']:.0f} MB)")
+        print(f"{'stage':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'total':>12}")
+        for stage, stats in sorted(summary['stages'].items()):
+            print(f"{stage:<10}{stats['p50']:>10.4f}{stats['p95']:>10.4f}"
+                  f"{stats['p99']:>10.4f}{stats['total']:>12.1f}")
+        return summary
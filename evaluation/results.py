@@ -0,0 +1,205 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import shutil
+
+# columns of every result row, then the columns of each metric, in result field order
+META_COLUMNS = [('key', 'string'), ('system', 'string'), ('run', 'string'), ('gen_wav', 'string')]
+METRIC_COLUMNS = {
+    'pesq': [('pesq', 'float64')],
+    'cos_sim': [('cos_sim', 'float64')],
+    'f0_rmse': [('f0_rmse', 'float64')],
+    'wer': [('wer', 'float64'), ('ref_txt', 'string'), ('hyp_txt', 'string'),
+            ('del', 'int64'), ('sub', 'int64'), ('ins', 'int64'), ('ref_len', 'int64'),
+            ('hyp_id', 'string')],
+    'mcd': [('mcd', 'float64')],
+    'utmos': [('utmos', 'float64')],
+}
+# nested fields, stored as json strings (null when empty)
+JSON_COLUMNS = [('errors', 'string'), ('timing', 'string')]
+# parquet results are committed in parts of this many rows, or every this many seconds
+PARQUET_PART_ROWS = 4096
+PARQUET_PART_SECONDS = 60
+
+
+def is_parquet(path):
+    return path.endswith('.parquet')
+
+
+def result_columns(metric_names):
+    columns = list(META_COLUMNS)
+    for name in metric_names:
+        columns.extend(METRIC_COLUMNS[name])
+    return columns + JSON_COLUMNS
+
+
+class JsonlResultWriter:
+    """One json line per result, flushed and synced to disk by flush().
+    Rows read back from parquet carry every column, the null and empty ones
+    (run, errors, timing, the extra wer fields of a failed row, ...) are
+    dropped so that lines match those of a JSONL run. The null fields of
+    metric_names are kept, they mark failed metrics.
+    """
+
+    def __init__(self, path, metric_names=(), append=False):
+        self.fout = open(path, 'a' if append else 'w')
+        self.metric_names = set(metric_names)
+
+    def write(self, result_dict):
+        result_dict = {name: value for name, value in result_dict.items()
+                       if name in self.metric_names or value not in (None, {})}
+        self.fout.write(json.dumps(result_dict, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def close(self):
+        self.fout.close()
+
+
+def parquet_parts_dir(path):
+    """Directory of the part files of a parquet result file still being written."""
+    return f'{path}.d'
+
+
+def parquet_sources(path):
+    """Files holding the rows of a parquet result: path once complete, then
+    the part files committed by a run that has not closed it (e.g. killed)."""
+    sources = [path] if os.path.exists(path) else []
+    parts_dir = parquet_parts_dir(path)
+    if os.path.isdir(parts_dir):
+        sources.extend(os.path.join(parts_dir, name) for name in sorted(os.listdir(parts_dir))
+                       if name.startswith('part-') and name.endswith('.parquet'))
+    return sources
+
+
+class ParquetResultWriter:
+    """Typed, columnar results: one column per result field (see result_columns).
+    flush() commits the pending rows as a readable part file in path.d once
+    there are part_rows of them or part_seconds went by since the last part,
+    so a kill loses at most one part (not one file per window to reopen),
+    and read_results (hence --resume) sees them. close() merges the parts
+    into path in row groups of row_group_size rows and removes path.d. With
+    append the rows of an existing file and of the parts of a killed run are kept.
+    """
+
+    def __init__(self, path, metric_names, append=False, row_group_size=65536,
+                 part_rows=PARQUET_PART_ROWS, part_seconds=PARQUET_PART_SECONDS):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.columns = result_columns(metric_names)
+        self.schema = pa.schema([(name, getattr(pa, dtype)()) for name, dtype in self.columns])
+        self.row_group_size = row_group_size
+        self.part_rows = part_rows
+        self.part_seconds = part_seconds
+        self.part_start = time.monotonic()
+        self.rows = []
+        self.parts_dir = parquet_parts_dir(path)
+        if not append:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            if os.path.exists(path):
+                os.remove(path)
+        os.makedirs(self.parts_dir, exist_ok=True)
+        # parts of a killed run are kept, new ones are numbered after them
+        self.parts = len([source for source in parquet_sources(path) if source != path])
+
+    def write(self, result_dict):
+        self.rows.append(result_dict)
+
+    def flush(self):
+        if (len(self.rows) >= self.part_rows
+                or time.monotonic() - self.part_start >= self.part_seconds):
+            self._write_part()
+
+    def _write_part(self):
+        self.part_start = time.monotonic()
+        if not self.rows:
+            return
+        columns = {}
+        for name, _ in self.columns:
+            values = [row.get(name) for row in self.rows]
+            if (name, 'string') in JSON_COLUMNS:
+                values = [json.dumps(value, ensure_ascii=False) if value else None
+                          for value in values]
+            columns[name] = values
+        # write then rename, readers never see a partial part
+        part_path = os.path.join(self.parts_dir, f'part-{self.parts:06d}.parquet')
+        self.pq.write_table(self.pa.table(columns, schema=self.schema), f'{part_path}.tmp')
+        os.replace(f'{part_path}.tmp', part_path)
+        self.parts += 1
+        self.rows = []
+
+    def close(self):
+        self._write_part()
+        tmp_path = f'{self.path}.tmp'
+        writer = self.pq.ParquetWriter(tmp_path, self.schema)
+        tables = []
+        rows = 0
+        for source in parquet_sources(self.path):
+            table = self.pq.read_table(source).cast(self.schema)
+            tables.append(table)
+            rows += table.num_rows
+            if rows >= self.row_group_size:
+                writer.write_table(self.pa.concat_tables(tables), row_group_size=self.row_group_size)
+                tables = []
+                rows = 0
+        if tables:
+            writer.write_table(self.pa.concat_tables(tables), row_group_size=self.row_group_size)
+        writer.close()
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+
+def open_result_writer(path, metric_names, append=False):
+    """Parquet writer for *.parquet paths (needs pyarrow), JSONL otherwise."""
+    if is_parquet(path):
+        return ParquetResultWriter(path, metric_names, append)
+    return JsonlResultWriter(path, metric_names, append)
+
+
+def read_results(path, columns=None):
+    """Iterate the result rows (dicts) of a JSONL or parquet result file,
+    including the committed parts of a parquet file not closed yet.
+    columns: fields to read, parquet files only read those columns from disk.
+    """
+    if not is_parquet(path):
+        with open(path, 'r') as fin:
+            for line in fin:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    import pyarrow.parquet as pq
+    sources = parquet_sources(path)
+    if not sources:
+        raise FileNotFoundError(path)
+    json_columns = [name for name, _ in JSON_COLUMNS]
+    for source in sources:
+        parquet_file = pq.ParquetFile(source)
+        source_columns = columns
+        if columns is not None:
+            available = set(parquet_file.schema_arrow.names)
+            source_columns = [name for name in columns if name in available]
+        for batch in parquet_file.iter_batches(columns=source_columns):
+            for row in batch.to_pylist():
+                for name in json_columns:
+                    if name in row:
+                        row[name] = json.loads(row[name]) if row[name] else {}
+                yield row
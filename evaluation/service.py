@@ -0,0 +1,231 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import json
+import time
+import queue
+import base64
+import socket
+import threading
+import socketserver
+import soundfile as sf
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from evaluation.audio import Audio, ArrayAudio, AudioPair
+from evaluation.loader import AudioLoader
+from evaluation.metrics import METRICS, parse_metrics, format_error, compute_cpu_metrics, score_pairs
+
+
+class Job:
+    """Rows of one client request, results are put to `results` as they are scored."""
+
+    def __init__(self, size):
+        self.size = size
+        self.results = queue.Queue()
+
+
+class EvalService:
+    """Scores the rows of concurrent jobs with models kept resident.
+    Rows of all jobs go through one queue, a scheduler thread takes up to
+    `window` of them (waiting at most batch_wait seconds for more to arrive)
+    and scores those sharing metrics and method in one batched pass.
+    models: ModelHub, only used by the scheduler thread.
+    executor: optional process pool for the CPU metrics.
+    """
+
+    def __init__(self, models, batch_size=1, window=16, batch_wait=0.05, cache=None,
+                 options=None, executor=None):
+        self.models = models
+        self.batch_size = batch_size
+        self.window = window
+        self.batch_wait = batch_wait
+        self.cache = cache
+        self.options = options or {}
+        self.executor = executor
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, rows, metric_names, method):
+        """Queue rows, a list of (key, AudioPair, text), returns their Job."""
+        job = Job(len(rows))
+        for key, audio_pair, text in rows:
+            self.pending.put({
+                'job': job,
+                'key': key,
+                'audio_pair': audio_pair,
+                'text': text,
+                'metric_names': tuple(metric_names),
+                'method': method,
+            })
+        return job
+
+    def _run(self):
+        while True:
+            items = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(items) < self.window:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            groups = {}
+            for item in items:
+                groups.setdefault((item['metric_names'], item['method']), []).append(item)
+            for (metric_names, method), group in groups.items():
+                try:
+                    self._score(group, metric_names, method)
+                except Exception as e:
+                    for item in group:
+                        item['job'].results.put({
+                            'key': item['key'], 'errors': {'service': format_error(e)}})
+
+    def _score(self, items, metric_names, method):
+        audio_pairs = [item['audio_pair'] for item in items]
+        cpu_futures = None
+        if self.executor is not None:
+            cpu_futures = [
+                self.executor.submit(
+                    compute_cpu_metrics, audio_pair, metric_names, method, self.cache, self.options)
+                for audio_pair in audio_pairs
+            ]
+        scores = score_pairs(
+            audio_pairs, [item['text'] for item in items], metric_names, self.models, method,
+            self.batch_size, self.cache, self.options, cpu_futures)
+        for item, audio_pair, score in zip(items, audio_pairs, scores):
+            result_dict = {'key': item['key'], 'gen_wav': audio_pair.deg.path, **score['fields']}
+            if score['errors']:
+                result_dict['errors'] = score['errors']
+            item['job'].results.put(result_dict)
+
+
+def _inline_audio(data, name):
+    wav, sr = sf.read(io.BytesIO(base64.b64decode(data)), dtype='float32', always_2d=True)
+    return ArrayAudio(wav.T, sr, name)
+
+
+def parse_job(job):
+    """Rows, metric names and method of a job request.
+    A job either names an input_file (lines of key, ref_wav, text) and a
+    wav_dir (optionally a shard_dir), or holds inline rows of key, text,
+    ref_wav or ref_audio, gen_wav or gen_audio. *_audio fields are base64
+    encoded audio files, scored without touching the disk.
+    """
+    metric_names = parse_metrics(job.get('metrics', ','.join(METRICS)))
+    method = job.get('method', 'cut')
+    if method not in ['cut', 'dtw']:
+        raise ValueError(f'unknown method {method}, choose between cut and dtw')
+    loader = AudioLoader(job.get('wav_dir'), job.get('shard_dir'))
+    rows = []
+    if 'input_file' in job:
+        with open(job['input_file'], 'r') as fin:
+            for line in fin:
+                row = json.loads(line)
+                rows.append((row['key'], loader.pair(row), row.get('text', '')))
+    for row in job.get('rows', []):
+        key = row['key']
+        if 'ref_audio' in row:
+            ref = _inline_audio(row['ref_audio'], f'{key}_ref')
+        else:
+            ref = Audio(row['ref_wav'])
+        if 'gen_audio' in row:
+            deg = _inline_audio(row['gen_audio'], key)
+        else:
+            deg = Audio(row.get('gen_wav') or loader.deg_path(row))
+        rows.append((key, AudioPair(ref, deg), row.get('text', '')))
+    return rows, metric_names, method
+
+
+class EvalRequestHandler(BaseHTTPRequestHandler):
+    """GET /health reports the service state, POST /score takes a job (see
+    parse_job) and streams one JSON line per scored row, then a final
+    {"done": true} line."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, obj):
+        line = (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+        self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        service = self.server.service
+        self._send_json(200, {
+            'status': 'ok',
+            'pending': service.pending.qsize(),
+            'models': sorted(service.models.models),
+        })
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            rows, metric_names, method = parse_job(json.loads(self.rfile.read(length)))
+        except Exception as e:
+            self._send_json(400, {'error': format_error(e)})
+            return
+        start = time.perf_counter()
+        job = self.server.service.submit(rows, metric_names, method)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for _ in range(job.size):
+            self._write_chunk(job.results.get())
+        self._write_chunk({'done': True, 'rows': job.size, 'seconds': time.perf_counter() - start})
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(service, host='127.0.0.1', port=8765, unix_socket=None):
+    """HTTP server of service, on a unix socket when unix_socket is set."""
+    if unix_socket is not None:
+        server = UnixHTTPServer(unix_socket, EvalRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), EvalRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
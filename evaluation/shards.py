@@ -0,0 +1,140 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import numpy as np
+from evaluation.audio import Audio
+
+SHARD_INDEX = 'index.json'
+SHARD_DTYPES = ['float32', 'int16']
+INT16_SCALE = 32768.0
+
+
+class ShardWriter:
+    """Packs decoded waveforms into a few contiguous PCM shard files.
+    output_dir: directory receiving shard_*.bin and the index.
+    dtype: float32 keeps the decoded samples exactly, int16 halves the size.
+    shard_bytes: a new shard is started once a shard grows past this size.
+    The index maps every packed name to (shard, offset, length, sample rate,
+    content hash of the source file), grouped by kind ('deg' entries are
+    keyed by row key, 'ref' entries by reference path).
+    """
+
+    def __init__(self, output_dir, dtype='float32', shard_bytes=1024 ** 3):
+        assert dtype in SHARD_DTYPES
+        self.output_dir = output_dir
+        self.dtype = np.dtype(dtype)
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self.entries = {'deg': {}, 'ref': {}}
+        self.fout = None
+        self.offset = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _next_shard(self):
+        if self.fout is not None:
+            self.fout.close()
+        name = f'shard_{len(self.shards):05d}.bin'
+        self.shards.append(name)
+        self.fout = open(os.path.join(self.output_dir, name), 'wb')
+        self.offset = 0
+
+    def add(self, kind, name, wav, sr, content_hash):
+        if self.fout is None or self.offset * self.dtype.itemsize >= self.shard_bytes:
+            self._next_shard()
+        if self.dtype == np.int16:
+            pcm = np.clip(np.round(wav * INT16_SCALE), -INT16_SCALE, INT16_SCALE - 1)
+        else:
+            pcm = wav
+        self.fout.write(np.ascontiguousarray(pcm, dtype=self.dtype).tobytes())
+        self.entries[kind][name] = [len(self.shards) - 1, self.offset, len(wav), int(sr), content_hash]
+        self.offset += len(wav)
+
+    def close(self):
+        if self.fout is not None:
+            self.fout.close()
+        with open(os.path.join(self.output_dir, SHARD_INDEX), 'w') as fout:
+            json.dump({
+                'dtype': self.dtype.name,
+                'shards': self.shards,
+                'entries': self.entries,
+            }, fout, ensure_ascii=False)
+
+
+class ShardAudio(Audio):
+    """Audio whose waveform is a slice of a memory-mapped shard.
+    path is the original file path, kept for result fields and hypotheses,
+    the file itself is never opened.
+    """
+
+    def __init__(self, path, samples, sr, content_hash):
+        super().__init__(path)
+        self._samples = samples
+        self._sr = sr
+        self._content_hash = content_hash
+
+    def _load(self):
+        if self._samples.dtype == np.int16:
+            wav = self._samples.astype(np.float32) / INT16_SCALE
+        else:
+            # zero copy, read-only view of the page cache
+            wav = np.asarray(self._samples)
+        self._views[self._sr] = wav
+
+    def resample(self, sr):
+        if self._sr not in self._views:
+            self._load()
+        return super().resample(sr)
+
+
+class ShardSet:
+    """Read side of a packed shard directory, shards are opened with numpy.memmap."""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, SHARD_INDEX), 'r') as fin:
+            index = json.load(fin)
+        self.dtype = np.dtype(index['dtype'])
+        self.entries = index['entries']
+        self.shards = [
+            np.memmap(os.path.join(shard_dir, name), dtype=self.dtype, mode='r')
+            for name in index['shards']
+        ]
+        # lookups of names that were not packed, per kind
+        self.misses = {kind: 0 for kind in self.entries}
+
+    def get(self, kind, name, path):
+        """ShardAudio of a packed entry, None if name was not packed.
+        Misses are counted and the first one of each kind is reported, a
+        --system given to main.py but not to pack.py misses every wav."""
+        entry = self.entries[kind].get(name)
+        if entry is None:
+            if self.misses[kind] == 0:
+                print(f'{kind} wav {name} is not in the shards of {self.shard_dir}, '
+                      f'reading {path} instead')
+            self.misses[kind] += 1
+            return None
+        shard, offset, length, sr, content_hash = entry
+        return ShardAudio(path, self.shards[shard][offset:offset + length], sr, content_hash)
+
+
+# one ShardSet per process and directory, the index is parsed once
+_SHARD_SETS = {}
+
+
+def open_shards(shard_dir):
+    if shard_dir not in _SHARD_SETS:
+        _SHARD_SETS[shard_dir] = ShardSet(shard_dir)
+    return _SHARD_SETS[shard_dir]
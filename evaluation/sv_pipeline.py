@@ -13,22 +13,38 @@
 # limitations under the License.
 
 import torch
-import librosa
+import numpy as np
+from collections import OrderedDict
 import torch.nn.functional as F
-from modelscope.pipelines import pipeline
-from transformers import Wav2Vec2FeatureExtractor, WavLMForXVector
+from evaluation.audio import SR_16K
+from evaluation.utils import length_sorted_batches
+
+# reference embeddings kept in memory per process
+REF_CACHE_SIZE = 100000
+
+
+def score_embeddings(embds_1, embds_2):
+    """Cosine similarity of paired (n, dim) embeddings, as a list of floats."""
+    return F.cosine_similarity(embds_1, embds_2, dim=-1).tolist()
 
 
 class SVPipeline:
     
-    def __init__(self, model='eres2net', lang='zh', device='cuda'):
+    def __init__(self, model='eres2net', lang='zh', device='cuda', cache=None):
         self.model = model
+        self.cache = cache
+        # reference content hash -> embedding, least recently used first
+        self.ref_embeddings = OrderedDict()
+        # import only the toolkit of the selected model
         if self.model == 'wavlm':
+            from transformers import Wav2Vec2FeatureExtractor, WavLMForXVector
+            self.model_id = "microsoft/wavlm-base-plus-sv"
+            self.model_revision = None
             try:
                 self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(
-                    "microsoft/wavlm-base-plus-sv"
+                    self.model_id
                 )
-                self.sv_model = WavLMForXVector.from_pretrained("microsoft/wavlm-base-plus-sv")
+                self.sv_model = WavLMForXVector.from_pretrained(self.model_id)
             except:
                 self.feature_extractor  = Wav2Vec2FeatureExtractor.from_pretrained(
                     "pretrained/wavlm", sampling_rate=16000
@@ -36,44 +52,116 @@ class SVPipeline:
                 self.sv_model = WavLMForXVector.from_pretrained("pretrained/wavlm")
             self.sv_model = self.sv_model.to(device)
         if self.model == 'eres2net':
+            from modelscope.pipelines import pipeline
             if lang == 'zh':
-                self.sv_model = pipeline(
-                    task='speaker-verification',
-                    model='damo/speech_eres2net_large_200k_sv_zh-cn_16k-common',
-                    model_revision='v1.0.0'
-                )
+                self.model_id = 'damo/speech_eres2net_large_200k_sv_zh-cn_16k-common'
+                self.model_revision = 'v1.0.0'
             if lang == 'en':
-                self.sv_model = pipeline(
-                    task='speaker-verification',
-                    model='iic/speech_eres2net_large_sv_en_voxceleb_16k'
-                )
+                self.model_id = 'iic/speech_eres2net_large_sv_en_voxceleb_16k'
+                self.model_revision = None
+            self.sv_model = pipeline(
+                task='speaker-verification',
+                model=self.model_id,
+                model_revision=self.model_revision
+            )
+
+    def compute_cos_sim_score(self, audio_pair):
+        return self.compute_cos_sim_scores([audio_pair])[0]
 
-    def compute_cos_sim_score(self, wav_1, wav_2):
-        spk1_wav, _ = librosa.load(wav_1, sr=16000)
-        spk2_wav, _ = librosa.load(wav_2, sr=16000)
+    def compute_cos_sim_scores(self, audio_pairs, batch_size=1):
+        """Speaker similarity for a list of AudioPair.
+        Reference embeddings are computed once per unique reference, the
+        synthesized wavs are embedded in batches.
+        """
+        embds_1 = self.embed_references(
+            [audio_pair.ref for audio_pair in audio_pairs], batch_size)
+        embds_2 = self.embed(
+            [self._input(audio_pair.deg) for audio_pair in audio_pairs], batch_size)
+        return score_embeddings(embds_1, embds_2)
 
+    def _input(self, audio):
+        # wavlm takes device tensors as they are, eres2net only takes numpy
+        if self.model == 'wavlm' and hasattr(audio, 'tensor'):
+            return audio.tensor(SR_16K)
+        return audio.resample(SR_16K)
+
+    def embed(self, wavs, batch_size=1):
+        """Speaker embeddings of 16 kHz wavs (numpy arrays, or torch tensors
+        for wavlm) as a (len(wavs), dim) cpu tensor.
+        wavlm embeds wavs in padded, length-sorted batches with an attention
+        mask, eres2net embeds one utterance per forward since the modelscope
+        model takes a single wav.
+        """
         if self.model == 'eres2net':
-            cos_sim = self.sv_model([spk1_wav, spk2_wav])['score']
+            embds = self.sv_model(wavs, output_emb=True)['embs']
+            return torch.as_tensor(embds)
         if self.model == 'wavlm':
-            inputs_1 = self.feature_extractor(
-                [spk1_wav], padding=True, return_tensors="pt", sampling_rate=16000
-            )
-            if torch.cuda.is_available():
-                for key in inputs_1.keys():
-                    inputs_1[key] = inputs_1[key].to(self.sv_model.device)
-            with torch.no_grad():
-                embds_1 = self.sv_model(**inputs_1).embeddings
-                embds_1 = embds_1[0]
+            return self._wavlm_embeddings(wavs, batch_size)
 
-            inputs_2 = self.feature_extractor(
-                [wav_2], padding=True, return_tensors="pt", sampling_rate=16000
-            )
-            if torch.cuda.is_available():
-                for key in inputs_2.keys():
-                    inputs_2[key] = inputs_2[key].to(self.sv_model.device)
+    def embed_references(self, audios, batch_size=1):
+        """Embeddings of reference Audio as a (len(audios), dim) cpu tensor.
+        Each reference is embedded once per process (and once across runs
+        with a FeatureCache), however many rows share it. References are
+        told apart by content hash, never by path: inline audio of the
+        service is named after client keys, which later jobs may reuse.
+        """
+        params = {'model': self.model_id, 'revision': self.model_revision, 'sample_rate': SR_16K}
+        missing = {}
+        for audio in audios:
+            if audio.content_hash in self.ref_embeddings:
+                self.ref_embeddings.move_to_end(audio.content_hash)
+                continue
+            embd = None if self.cache is None else self.cache.get(audio, 'speaker_embedding', params)
+            if embd is None:
+                missing.setdefault(audio.content_hash, audio)
+            else:
+                self._remember(audio.content_hash, torch.as_tensor(np.array(embd)))
+        if missing:
+            missing = list(missing.values())
+            new_embds = self.embed([audio.resample(SR_16K) for audio in missing], batch_size)
+            for audio, embd in zip(missing, new_embds):
+                if self.cache is not None:
+                    self.cache.put(audio, 'speaker_embedding', params, embd.numpy())
+                self._remember(audio.content_hash, embd)
+        return torch.stack([self.ref_embeddings[audio.content_hash] for audio in audios])
 
+    def _remember(self, content_hash, embd):
+        self.ref_embeddings[content_hash] = embd
+        if len(self.ref_embeddings) > REF_CACHE_SIZE:
+            self.ref_embeddings.popitem(last=False)
+
+    def _wavlm_embeddings(self, wavs, batch_size):
+        embds = [None] * len(wavs)
+        for batch in length_sorted_batches([len(wav) for wav in wavs], batch_size):
+            if all(isinstance(wavs[i], torch.Tensor) for i in batch):
+                inputs = self._wavlm_tensor_inputs([wavs[i] for i in batch])
+            else:
+                inputs = self.feature_extractor(
+                    [wavs[i].cpu().numpy() if isinstance(wavs[i], torch.Tensor) else wavs[i]
+                     for i in batch],
+                    padding=True,
+                    return_attention_mask=True,
+                    return_tensors="pt",
+                    sampling_rate=SR_16K
+                )
+            for key in inputs.keys():
+                inputs[key] = inputs[key].to(self.sv_model.device)
             with torch.no_grad():
-                embds_2 = self.sv_model(**inputs_2).embeddings
-                embds_2 = embds_2[0]
-            cos_sim = F.cosine_similarity(embds_1, embds_2, dim=-1).detach().cpu().numpy()
-        return cos_sim
+                batch_embds = self.sv_model(**inputs).embeddings
+            for i, embd in zip(batch, batch_embds.cpu()):
+                embds[i] = embd
+        return torch.stack(embds)
+
+    def _wavlm_tensor_inputs(self, wavs):
+        """The feature extractor output (zero mean, unit variance over the
+        unpadded samples, zero padding, attention mask) computed on the
+        device of the tensors."""
+        device = self.sv_model.device
+        lengths = [len(wav) for wav in wavs]
+        input_values = torch.zeros(len(wavs), max(lengths), device=device)
+        attention_mask = torch.zeros(len(wavs), max(lengths), dtype=torch.long, device=device)
+        for i, wav in enumerate(wavs):
+            wav = wav.to(device)
+            input_values[i, :len(wav)] = (wav - wav.mean()) / torch.sqrt(wav.var(unbiased=False) + 1e-7)
+            attention_mask[i, :len(wav)] = 1
+        return {'input_values': input_values, 'attention_mask': attention_mask}
@@ -97,3 +97,14 @@ def get_pitch_sub_median(f0_hz):
     """
     f0_cent = get_cents(f0_hz)
     return f0_cent - np.median(f0_cent)
+
+
+def length_sorted_batches(lengths, batch_size):
+    """Split item indices into batches of similar length to limit padding.
+    lengths: length of every item.
+    batch_size: maximum number of items per batch.
+    Returns a list of index lists, longest items first, so callers can
+    scatter batch outputs back to the original positions.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
@@ -12,9 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import torch
-import librosa
-from pydub import AudioSegment
+import numpy as np
+from evaluation.audio import SR_16K
+from evaluation.cache import cached
+
+UTMOS_REPO = "tarepan/SpeechMOS:v1.2.0"
+UTMOS_CKPT = "utmos22_strong_step7459_v1.pt"
 
 
 def torch_rms_norm(wav, db_level=-27.0):
@@ -23,14 +28,73 @@ def torch_rms_norm(wav, db_level=-27.0):
     return wav * a
 
 
-def extract_utmos(ref_wav, deg_wav, device):
-    ref_dBFS = AudioSegment.from_file(ref_wav).dBFS
-    # uses UTMOS (https://arxiv.org/abs/2204.02152) Open source (https://github.com/tarepan/SpeechMOS) following https://arxiv.org/abs/2311.12454
-    mos_predictor = torch.hub.load("tarepan/SpeechMOS:v1.2.0", "utmos22_strong", trust_repo=True).to(device)
-    audio, sr = librosa.load(deg_wav, sr=None, mono=True)
-    audio = torch.from_numpy(audio).unsqueeze(0)
-    # RMS norm based on the reference audio dBFS it make all models output in the same db level and it avoid issues
-    audio = torch_rms_norm(audio, db_level=ref_dBFS)
-    # predict UTMOS
-    score = mos_predictor(audio.to(device), sr).item()
-    return score
+def get_dbfs(wav):
+    """Loudness of a float waveform in dBFS, the same quantity as pydub's AudioSegment.dBFS."""
+    rms = np.sqrt(np.mean(np.square(wav, dtype=np.float64)))
+    if rms == 0:
+        return -float('inf')
+    return 20 * np.log10(rms)
+
+
+class UTMOSPipeline:
+    """UTMOS (https://arxiv.org/abs/2204.02152) naturalness predictor, loaded once per process.
+    Uses the open source SpeechMOS (https://github.com/tarepan/SpeechMOS) following https://arxiv.org/abs/2311.12454.
+    model_dir: optional local clone of SpeechMOS holding the `utmos22_strong` checkpoint,
+               used instead of torch.hub downloads so evaluation works offline.
+    cache: optional FeatureCache for the reference dBFS.
+    """
+
+    def __init__(self, device='cuda', model_dir=None, cache=None):
+        self.device = device
+        self.cache = cache
+        if model_dir is None:
+            self.mos_predictor = torch.hub.load(UTMOS_REPO, "utmos22_strong", trust_repo=True)
+        else:
+            self.mos_predictor = torch.hub.load(
+                model_dir, "utmos22_strong", source='local', pretrained=False
+            )
+            state_dict = torch.load(os.path.join(model_dir, UTMOS_CKPT), map_location='cpu')
+            self.mos_predictor.load_state_dict(state_dict)
+        self.mos_predictor = self.mos_predictor.to(device)
+        self.mos_predictor.eval()
+
+    def compute_utmos_score(self, audio_pair):
+        return self.compute_utmos_scores([audio_pair])[0]
+
+    def compute_utmos_scores(self, audio_pairs, batch_size=1):
+        """Predict UTMOS for a list of AudioPair, one forward pass per batch.
+        SpeechMOS takes no padding mask and averages over all frames, so a
+        batch only ever holds utterances of the same length and nothing is
+        padded; utterances of distinct lengths are scored one at a time.
+        """
+        wavs = []
+        for audio_pair in audio_pairs:
+            ref_dBFS = float(cached(
+                self.cache, audio_pair.ref, 'dbfs', {}, lambda: get_dbfs(audio_pair.ref.wav)))
+            if hasattr(audio_pair.deg, 'tensor'):
+                # already on a device, no host round trip
+                audio = audio_pair.deg.tensor(SR_16K)
+            else:
+                audio = torch.from_numpy(audio_pair.deg.resample(SR_16K))
+            audio = audio.to(self.device)
+            # RMS norm based on the reference audio dBFS it make all models output in the same db level and it avoid issues
+            wavs.append(torch_rms_norm(audio, db_level=ref_dBFS))
+
+        same_length = {}
+        for i, wav in enumerate(wavs):
+            same_length.setdefault(len(wav), []).append(i)
+        batches = [
+            indices[start:start + batch_size]
+            for indices in same_length.values()
+            for start in range(0, len(indices), batch_size)
+        ]
+
+        scores = [None] * len(wavs)
+        for batch in batches:
+            audio = torch.stack([wavs[i] for i in batch])
+            # predict UTMOS
+            with torch.no_grad():
+                batch_scores = self.mos_predictor(audio.to(self.device), SR_16K)
+            for i, score in zip(batch, batch_scores.tolist()):
+                scores[i] = score
+        return scores
@@ -0,0 +1,68 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import numpy as np
+from evaluation.audio import AudioPair, TrimmedAudio
+from evaluation.cache import cached
+
+VAD_FRAME_MS = 20
+VAD_HOP_MS = 10
+
+
+def speech_bounds(wav, sr, top_db=40.0, margin_ms=100.0):
+    """(start, end) in seconds of the speech of wav, leading and trailing
+    frames more than top_db below the loudest frame are silence, margin_ms
+    of it is kept on both sides. Frame energies come from a cumulative sum
+    of the squared samples, one pass over the waveform.
+    Silent or too short waveforms are kept whole.
+    """
+    frame = int(sr * VAD_FRAME_MS / 1000)
+    hop = int(sr * VAD_HOP_MS / 1000)
+    duration = len(wav) / sr
+    if len(wav) < frame:
+        return 0.0, duration
+    power = np.concatenate([[0.0], np.cumsum(np.square(wav, dtype=np.float64))])
+    starts = np.arange(0, len(wav) - frame + 1, hop)
+    energy = (power[starts + frame] - power[starts]) / frame
+    db = 10 * np.log10(np.maximum(energy, 1e-10))
+    speech = db > db.max() - top_db
+    if db.max() <= -100 or not speech.any():
+        return 0.0, duration
+    first = starts[np.argmax(speech)]
+    last = starts[len(speech) - 1 - np.argmax(speech[::-1])] + frame
+    margin = margin_ms / 1000
+    return max(0.0, float(first / sr - margin)), min(duration, float(last / sr + margin))
+
+
+def trimmed(audio, vad, cache=None):
+    """TrimmedAudio of audio with the vad options (top_db, margin_ms).
+    The bounds are computed once per file (and stored in cache), the
+    trimmed audio is kept on the audio object, so a reference shared by
+    several rows is trimmed once."""
+    key = 'trimmed:' + json.dumps(vad, sort_keys=True)
+    if key not in audio.features:
+        bounds = cached(
+            cache, audio, 'vad', vad,
+            lambda: np.array(speech_bounds(audio.wav, audio.sr, **vad)))
+        audio.features[key] = TrimmedAudio(audio, float(bounds[0]), float(bounds[1]))
+    return audio.features[key]
+
+
+def trim_pair(audio_pair, vad, cache=None):
+    """AudioPair of the trimmed reference and synthesized audio, audio_pair
+    itself when vad is None or it is trimmed already."""
+    if not vad or isinstance(audio_pair.deg, TrimmedAudio):
+        return audio_pair
+    return AudioPair(trimmed(audio_pair.ref, vad, cache), trimmed(audio_pair.deg, vad, cache))
@@ -0,0 +1,125 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import string
+from zhon import hanzi
+from rapidfuzz.distance import Levenshtein
+from evaluation.results import METRIC_COLUMNS, open_result_writer, read_results
+
+# one C level pass per string instead of one replace per punctuation mark
+EN_TABLE = str.maketrans('', '', string.punctuation)
+ZH_TABLE = str.maketrans('', '', hanzi.punctuation + ' ')
+
+
+def normalize_text(text, lang):
+    if lang == 'en':
+        return text.translate(EN_TABLE).lower()
+    if lang == 'zh':
+        return text.translate(ZH_TABLE)
+    raise ValueError(f'unsupported language {lang}')
+
+
+def tokenize(text, lang):
+    """Words for en, characters for zh."""
+    if lang == 'en':
+        return text.split()
+    return list(text)
+
+
+def edit_counts(ref, hyp):
+    """Substitutions, deletions and insertions turning token list ref into hyp.
+    Every edited token counts, not every edit block."""
+    sub = dele = ins = 0
+    for tag, _, _ in Levenshtein.editops(ref, hyp):
+        if tag == 'replace':
+            sub += 1
+        elif tag == 'delete':
+            dele += 1
+        else:
+            ins += 1
+    return sub, dele, ins
+
+
+def compute_wer(ref_text, hyp_text, lang):
+    """Word error rate for en, character error rate for zh, of one hypothesis."""
+    ref_text = normalize_text(ref_text, lang)
+    hyp_text = normalize_text(hyp_text, lang)
+    ref = tokenize(ref_text, lang)
+    hyp = tokenize(hyp_text, lang)
+    sub, dele, ins = edit_counts(ref, hyp)
+    edits = sub + dele + ins
+    if len(ref) > 0:
+        wer = edits / len(ref)
+    else:
+        wer = float(edits > 0)
+    return {
+        "ref": ref_text,
+        "hyp": hyp_text,
+        "wer": wer,
+        "cor": len(ref) - sub - dele,
+        "del": dele,
+        "ins": ins,
+        "sub": sub,
+        "ref_len": len(ref)
+    }
+
+
+def compute_wer_batch(ref_texts, hyp_texts, lang):
+    return [compute_wer(ref_text, hyp_text, lang) for ref_text, hyp_text in zip(ref_texts, hyp_texts)]
+
+
+def wer_fields(wer_):
+    """Result fields of a compute_wer output."""
+    return {
+        'wer': wer_['wer'],
+        'ref_txt': wer_['ref'],
+        'hyp_txt': wer_['hyp'],
+        'del': wer_['del'],
+        'sub': wer_['sub'],
+        'ins': wer_['ins'],
+        'ref_len': wer_['ref_len'],
+    }
+
+
+def rescore_file(result_file, output_file, lang, ref_texts=None, hyp_texts=None):
+    """Recompute the wer fields of every row of a result file, without running ASR.
+    result_file, output_file: JSONL or parquet, see evaluation.results.
+    ref_texts: optional dict of key -> raw reference text.
+    hyp_texts: optional dict of hypothesis id (the hyp_id field of a row) -> raw hypothesis.
+    Rows missing from them, or written without a hyp_id, fall back to their
+    stored ref_txt / hyp_txt.
+    Rows without a hypothesis (failed ASR) are copied unchanged.
+    """
+    ref_texts = ref_texts or {}
+    hyp_texts = hyp_texts or {}
+    rows = 0
+    writer = None
+    try:
+        for line_dict in read_results(result_file):
+            if writer is None:
+                # the metrics of the result file, whose rows all carry their fields
+                metric_names = [name for name in METRIC_COLUMNS if name in line_dict or name == 'wer']
+                writer = open_result_writer(output_file, metric_names)
+            ref_text = ref_texts.get(line_dict.get('key'), line_dict.get('ref_txt'))
+            hyp_text = hyp_texts.get(line_dict.get('hyp_id'), line_dict.get('hyp_txt'))
+            if ref_text is not None and hyp_text is not None:
+                line_dict.update(wer_fields(compute_wer(ref_text, hyp_text, lang)))
+            writer.write(line_dict)
+            rows += 1
+        if writer is None:
+            writer = open_result_writer(output_file, ['wer'])
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
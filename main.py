@@ -12,15 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import json
+import cProfile
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from evaluation.pesq import extract_pesq
-from evaluation.f0_rmse import extract_f0rmse
-from evaluation.sv_pipeline import SVPipeline
-from evaluation.asr_pipeline import ASRPipeline
-from evaluation.mel_cepstral_distortion import extract_mcd
-from evaluation.utmos import extract_utmos
+from evaluation.loader import AudioLoader, Prefetcher, parse_wav_dirs
+from evaluation.cli import add_scoring_args, check_scoring_args, metric_options, asr_options, open_cache
+from evaluation.partition import select_shard
+from evaluation.shards import open_shards
+from evaluation.profiling import RunStats
+from evaluation.results import is_parquet, parquet_sources, open_result_writer, read_results
+from evaluation.metrics import (
+    METRICS,
+    ModelHub,
+    default_builders,
+    parse_metrics,
+    compute_cpu_metrics_batch,
+    score_pairs)
+
+BUCKET_BATCHES = 16
 
 
 def get_args():
@@ -32,17 +45,65 @@ def get_args():
         required=True,
         help="json file contains reference wav, sythesised wav, text.",
     )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=",".join(METRICS),
+        help=f"comma separated metrics to compute, from {','.join(METRICS)}"
+    )
     parser.add_argument(
         "--wav_dir",
         type=str,
         required=True,
-        help="directory of synthesised wav"
+        help="directory of synthesised wav, or comma separated name=directory entries "
+             "to score several systems against the same references in one pass"
     )
     parser.add_argument(
         "--result_file",
         type=str,
         required=True,
-        help="result file recoring the metrics",
+        help="result file recoring the metrics, jsonl, or typed columns if it ends "
+             "with .parquet (needs pyarrow)",
+    )
+    parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=1,
+        help="split the input rows into this many shards, e.g. one per machine, "
+             "and score only the shard --shard_index, merge the results with merge.py"
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        default=0,
+        help="shard scored by this run, from 0 to num_shards - 1"
+    )
+    parser.add_argument(
+        "--shard_balance",
+        type=str,
+        default="duration",
+        help="duration balances the audio seconds of the shards (reads the wav headers), "
+             "hash splits the rows by key hash only"
+    )
+    parser.add_argument(
+        "--system",
+        type=str,
+        default=None,
+        help="name of the evaluated system (a single --wav_dir), recorded in a 'system' "
+             "field of each result"
+    )
+    parser.add_argument(
+        "--run_name",
+        type=str,
+        default=None,
+        help="name of this evaluation run, recorded in a 'run' field of each result"
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        default=None,
+        help="audio packed by pack.py, read through memory maps instead of "
+             "opening every wav, rows missing from it fall back to the loose files"
     )
     parser.add_argument(
         "--method",
@@ -50,73 +111,245 @@ def get_args():
         default='cut',
         help="choose between cut and dtw.")
     parser.add_argument(
-        "--lang",
-        type=str,
-        required=True,
-        help="language of the text, choose between zh and en"
+        "--num_workers",
+        type=int,
+        default=0,
+        help="processes computing pesq, f0 rmse and mcd, 0 computes them in the main process"
     )
     parser.add_argument(
-        "--device",
-        type=str,
-        required=True,
-        help="choose cuda"
+        "--prefetch",
+        type=int,
+        default=1,
+        help="windows of rows decoded and resampled ahead of the one being scored, 0 disables it"
     )
     parser.add_argument(
-        "--sim_model",
+        "--decode_threads",
+        type=int,
+        default=2,
+        help="threads decoding the prefetched audio"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="append to an existing result file and only score the keys missing from it"
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="record the wall time of every stage in a 'timing' field of each result"
+    )
+    parser.add_argument(
+        "--profile",
         type=str,
-        default='eres2net',
-        help="choose between eres2net and wavlm"
+        default=None,
+        help="directory receiving cProfile dumps of sampled windows of rows"
+    )
+    parser.add_argument(
+        "--profile_interval",
+        type=int,
+        default=10,
+        help="profile one window out of every profile_interval windows"
     )
+    add_scoring_args(parser)
     return parser.parse_args()
 
 
+def _cpu_worker(loader, rows, metric_names, method, cache, options):
+    # decode inside the worker, only the rows and the loader cross the process boundary
+    return compute_cpu_metrics_batch(loader.pairs(rows), metric_names, method, cache, options)
+
+
+class _RowFuture:
+    """Result of one row of a future computing a group of rows."""
+
+    def __init__(self, future, index):
+        self.future = future
+        self.index = index
+
+    def result(self):
+        return self.future.result()[self.index]
+
+
+def reference_groups(rows):
+    """Runs of consecutive rows sharing a reference, e.g. the systems of one input row."""
+    groups = []
+    for row in rows:
+        if groups and groups[-1][0]['ref_wav'] == row['ref_wav']:
+            groups[-1].append(row)
+        else:
+            groups.append([row])
+    return groups
+
+
+def submit_cpu_metrics(executor, loader, rows, args, metric_names, cache):
+    """One future per row, the rows sharing a reference go to the same worker
+    which extracts the reference features once."""
+    futures = []
+    for group in reference_groups(rows):
+        future = executor.submit(
+            _cpu_worker, loader, group, metric_names, args.method, cache, metric_options(args))
+        futures.extend(_RowFuture(future, i) for i in range(len(group)))
+    return futures
+
+
+def evaluate_rows(rows, args, loader, metric_names, models, cpu_futures=None, cache=None,
+                  stats=None, audio_pairs=None):
+    """Score a window of input rows.
+    The neural models run batched over the window and their outputs are
+    scattered back to the rows in input order. CPU metrics are either read
+    from cpu_futures (computed by the worker pool) or computed in process.
+    Stage timings of every row are added to stats when given.
+    audio_pairs: AudioPair of the rows, already decoded by the prefetcher.
+    """
+    if audio_pairs is None:
+        audio_pairs = loader.pairs(rows)
+    scores = score_pairs(
+        audio_pairs, [row.get('text', '') for row in rows], metric_names, models, args.method,
+        args.batch_size, cache, metric_options(args), cpu_futures)
+
+    results = []
+    for row, audio_pair, score in zip(rows, audio_pairs, scores):
+        result_dict = {'key': row['key']}
+        if row.get('system') is not None:
+            result_dict['system'] = row['system']
+        if args.run_name is not None:
+            result_dict['run'] = args.run_name
+        result_dict.update({'gen_wav': audio_pair.deg.path, **score['fields']})
+        if score['errors']:
+            result_dict['errors'] = score['errors']
+        if args.timing:
+            result_dict['timing'] = score['timing']
+        if stats is not None:
+            # decoded by the model metrics or the cpu worker, never again here
+            stats.add(score['timing'], score['duration'] or 0.0)
+        results.append(result_dict)
+    return results
+
+
+def load_completed_keys(result_file):
+    """(system, key) of the rows already scored in result_file, system is
+    None for results without a system field.
+    A trailing line cut short by a crash is truncated away so that appending
+    to the file keeps it valid JSONL.
+    """
+    completed = set()
+    if is_parquet(result_file):
+        # the complete file of a finished run and the parts committed by a killed one
+        if not parquet_sources(result_file):
+            return completed
+        return {(row.get('system'), row['key'])
+                for row in read_results(result_file, ['system', 'key'])}
+    if not os.path.exists(result_file):
+        return completed
+    valid_bytes = 0
+    with open(result_file, 'rb') as fin:
+        for line in fin:
+            try:
+                line_dict = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            if 'key' in line_dict:
+                completed.add((line_dict.get('system'), line_dict['key']))
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(result_file):
+        with open(result_file, 'rb+') as fout:
+            fout.truncate(valid_bytes)
+    return completed
+
+
 def main():
     args = get_args()
-    assert args.lang in ['zh', 'en']
     assert args.method in ['cut', 'dtw']
-    assert args.sim_model in ['eres2net', 'wavlm']
-    asr_model = ASRPipeline(lang=args.lang)
-    sv_model = SVPipeline(model=args.sim_model, lang=args.lang, device=args.device)
+    metric_names = parse_metrics(args.metrics)
+    check_scoring_args(args, metric_names)
+    cpu_metric_names = [name for name in metric_names if METRICS[name].model is None]
+    assert args.num_workers >= 0
+    assert args.profile_interval >= 1
+    assert args.prefetch >= 0
+    assert args.decode_threads >= 1
+    assert 0 <= args.shard_index < args.num_shards
+    assert args.shard_balance in ['duration', 'hash']
+    if args.profile is not None:
+        os.makedirs(args.profile, exist_ok=True)
+    executor = None
+    if args.num_workers > 0 and cpu_metric_names:
+        # spawn keeps the workers clear of the CUDA state of the model process
+        executor = ProcessPoolExecutor(
+            max_workers=args.num_workers, mp_context=multiprocessing.get_context('spawn'))
+    cache = open_cache(args)
+    # models are built by the first metric needing them
+    models = ModelHub(default_builders(
+        args.lang, args.device, args.sim_model, args.utmos_model_dir, cache, args.hyp_file,
+        asr_options(args)))
+    wav_dirs = parse_wav_dirs(args.wav_dir, args.system)
+    loader = AudioLoader(wav_dirs, args.shard_dir)
     with open(args.input_file, 'r') as fin:
-        with open(args.result_file, 'w') as fout:
-            for line in tqdm(fin.readlines()):
-                line_dict = json.loads(line)
-                ref_text = line_dict['text']
-                audio_ref = line_dict['ref_wav']
-                wav_name = line_dict['key'] + '.wav'
-                audio_deg = f'{args.wav_dir}/{wav_name}'
-                result_dict = {'gen_wav': audio_deg}
-
-                pesq = extract_pesq(audio_ref, audio_deg, method=args.method)
-                result_dict['pesq'] = pesq
-
-                cos_sim = sv_model.compute_cos_sim_score(audio_ref, audio_deg)
-                result_dict['cos_sim'] = cos_sim
-
-                f0_rmse = extract_f0rmse(audio_ref, audio_deg, method=args.method)
-                result_dict['f0_rmse'] = f0_rmse
-
-                if args.lang == 'zh':
-                    hyp_text = asr_model.infer_zh(audio_deg)
-                    wer_ = asr_model.get_wer(ref_text, hyp_text)
-                elif args.lang == 'en':
-                    hyp_text = asr_model.infer_en(audio_deg)
-                    wer_ = asr_model.get_wer(ref_text, hyp_text)
-                result_dict['wer'] = wer_['wer']
-                result_dict['ref_txt'] = wer_['ref']
-                result_dict['hyp_txt'] = wer_['hyp']
-                result_dict['del'] = wer_['del']
-                result_dict['sub'] = wer_['sub']
-                result_dict['ins'] = wer_['ins']
-
-                mcd = extract_mcd(audio_ref, audio_deg)
-                result_dict['mcd'] = mcd
-
-                utmos = extract_utmos(audio_ref, audio_deg, args.device)
-                result_dict['utmos'] = utmos
-
-                fout.writelines(json.dumps(result_dict, ensure_ascii=False) + '\n')
-        return
+        input_rows = [json.loads(line) for line in fin]
+    if args.num_shards > 1:
+        # all systems of an input row land in the same shard
+        duration = None
+        if args.shard_balance == 'duration':
+            duration = lambda row: loader.duration(row, list(wav_dirs))
+        input_rows = select_shard(input_rows, args.shard_index, args.num_shards, duration)
+    # every system of an input row follows it, so that they share a window and its reference
+    rows = [{**row, 'system': system} for row in input_rows for system in wav_dirs]
+    completed = load_completed_keys(args.result_file) if args.resume else set()
+    rows = [row for row in rows if (row['system'], row['key']) not in completed]
+    # rows are scored in windows of several batches so that the models can
+    # group utterances of similar length and the workers always have work queued,
+    # the batches mix the outputs of all systems
+    window = max(args.batch_size * BUCKET_BATCHES, args.num_workers * 4)
+    window = -(-window // len(wav_dirs)) * len(wav_dirs)
+    windows = [rows[start:start + window] for start in range(0, len(rows), window)]
+    cpu_futures = [None] * len(windows)
+    window_pairs = [None] * len(windows)
+    if args.prefetch > 0:
+        # the worker pool decodes for the cpu metrics, the main process only
+        # needs the views of the model metrics
+        prefetch_metrics = metric_names if executor is None else [
+            name for name in metric_names if METRICS[name].model is not None]
+        sample_rates = {sr for name in prefetch_metrics for sr in METRICS[name].sample_rates}
+        window_pairs = Prefetcher(
+            loader, windows, sample_rates, args.decode_threads, args.prefetch)
+    stats = RunStats()
+    writer = open_result_writer(args.result_file, metric_names, append=args.resume)
+    try:
+        with tqdm(total=len(rows)) as pbar:
+            for k, (window_rows, audio_pairs) in enumerate(zip(windows, window_pairs)):
+                if executor is not None:
+                    # keep the pool one window ahead of the model consumer
+                    for ahead in (k, k + 1):
+                        if ahead < len(windows) and cpu_futures[ahead] is None:
+                            cpu_futures[ahead] = submit_cpu_metrics(
+                                executor, loader, windows[ahead], args, metric_names, cache)
+                profiler = None
+                if args.profile is not None and k % args.profile_interval == 0:
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                results = evaluate_rows(
+                    window_rows, args, loader, metric_names, models, cpu_futures[k], cache, stats,
+                    audio_pairs)
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(os.path.join(args.profile, f'window_{k:06d}.prof'))
+                cpu_futures[k] = None
+                for result_dict in results:
+                    writer.write(result_dict)
+                # a kill loses at most the window being scored (jsonl) or one part (parquet)
+                writer.flush()
+                pbar.update(len(window_rows))
+    finally:
+        writer.close()
+    if executor is not None:
+        executor.shutdown()
+    if args.shard_dir is not None:
+        misses = open_shards(args.shard_dir).misses
+        if any(misses.values()):
+            print(f'Read from loose files instead of {args.shard_dir} (in the main process): '
+                  + ', '.join(f'{count} {kind} wavs' for kind, count in misses.items() if count))
+    stats.print_summary()
 
 
 if __name__ == "__main__":
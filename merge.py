@@ -0,0 +1,121 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import json
+import argparse
+from evaluation.aggregate import average_rows
+from evaluation.loader import parse_wav_dirs
+from evaluation.results import METRIC_COLUMNS, open_result_writer, read_results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="merge the result files of main.py --shard_index/--num_shards runs.")
+    parser.add_argument(
+        "--result_files",
+        type=str,
+        nargs="+",
+        required=True,
+        help="result files of every shard, jsonl or parquet"
+    )
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        required=True,
+        help="input file given to every shard, defines the expected keys and their order"
+    )
+    parser.add_argument(
+        "--wav_dir",
+        type=str,
+        default=None,
+        help="--wav_dir given to the shards, every named system is expected for every key, "
+             "defaults to the systems found in the results"
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        required=True,
+        help="merged result file, in input order as written by a single run"
+    )
+    parser.add_argument(
+        "--average_file",
+        type=str,
+        default=None,
+        help="also write the average.py output of the merged results to this file"
+    )
+    parser.add_argument(
+        "--allow_incomplete",
+        action="store_true",
+        help="write the merged results even if rows are missing or duplicated"
+    )
+    return parser.parse_args()
+
+
+def _report(name, items, limit=10):
+    if items:
+        shown = ', '.join(f'{key} ({system})' if system is not None else str(key)
+                          for system, key in items[:limit])
+        more = f' and {len(items) - limit} more' if len(items) > limit else ''
+        print(f'{len(items)} {name}: {shown}{more}')
+
+
+def main():
+    args = get_args()
+    with open(args.input_file, 'r') as fin:
+        keys = [json.loads(line)['key'] for line in fin if line.strip()]
+    results = {}
+    duplicates = []
+    for result_file in args.result_files:
+        for row in read_results(result_file):
+            row_id = (row.get('system'), row['key'])
+            if row_id in results:
+                duplicates.append(row_id)
+            else:
+                results[row_id] = row
+    if args.wav_dir is not None:
+        systems = list(parse_wav_dirs(args.wav_dir))
+    else:
+        systems = list(dict.fromkeys(system for system, _ in results))
+    expected = [(system, key) for key in keys for system in systems]
+    missing = [row_id for row_id in expected if row_id not in results]
+    unexpected = sorted(set(results) - set(expected), key=str)
+    print(f'{len(results)} rows from {len(args.result_files)} files, '
+          f'{len(expected)} expected ({len(keys)} keys x {len(systems)} systems)')
+    _report('missing rows', missing)
+    _report('duplicated rows', duplicates)
+    _report('rows not in the input file', unexpected)
+    complete = not (missing or duplicates or unexpected)
+    if not complete and not args.allow_incomplete:
+        print('Merge incomplete, nothing written (see --allow_incomplete)')
+        sys.exit(1)
+
+    merged = [results[row_id] for row_id in expected if row_id in results]
+    # the metrics of the shards, whose rows all carry their fields (null when failed)
+    metric_names = [name for name in METRIC_COLUMNS if any(name in row for row in merged)]
+    writer = open_result_writer(args.output_file, metric_names)
+    try:
+        for row in merged:
+            writer.write(row)
+    finally:
+        writer.close()
+    print(f'Save result to {args.output_file}')
+    if args.average_file is not None:
+        with open(args.average_file, 'w') as fout:
+            json.dump(average_rows(merged), fout, ensure_ascii=False)
+        print(f'Save average to {args.average_file}')
+
+
+if __name__ == "__main__":
+    main()
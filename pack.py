@@ -0,0 +1,89 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import argparse
+from tqdm import tqdm
+from evaluation.audio import Audio
+from evaluation.loader import parse_wav_dirs, shard_name
+from evaluation.shards import SHARD_DTYPES, ShardWriter
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="pack the reference and synthesised wavs of an input file into memory-mappable shards.")
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        required=True,
+        help="json file contains reference wav, sythesised wav, text.",
+    )
+    parser.add_argument(
+        "--wav_dir",
+        type=str,
+        default=None,
+        help="directory of synthesised wav, or comma separated name=directory entries "
+             "(as given to main.py), only the reference wavs are packed if not set"
+    )
+    parser.add_argument(
+        "--system",
+        type=str,
+        default=None,
+        help="name of the system of a single --wav_dir, as given to main.py --system, "
+             "its wavs are packed under that name"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="directory receiving the shards and their index, given to main.py --shard_dir"
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="float32",
+        help="sample format of the shards, float32 (exact) or int16 (half the size)"
+    )
+    parser.add_argument(
+        "--shard_size_mb",
+        type=int,
+        default=1024,
+        help="approximate size of every shard file"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    assert args.dtype in SHARD_DTYPES
+    writer = ShardWriter(args.output_dir, args.dtype, args.shard_size_mb * 1024 ** 2)
+    with open(args.input_file, 'r') as fin:
+        rows = [json.loads(line) for line in fin]
+    wav_dirs = parse_wav_dirs(args.wav_dir, args.system) if args.wav_dir is not None else {}
+    for row in tqdm(rows):
+        # references are often shared by many rows, pack each once
+        if row['ref_wav'] not in writer.entries['ref']:
+            audio = Audio(row['ref_wav'])
+            writer.add('ref', row['ref_wav'], audio.wav, audio.sr, audio.content_hash)
+        for system, wav_dir in wav_dirs.items():
+            audio = Audio(f'{wav_dir}/{row["key"]}.wav')
+            writer.add('deg', shard_name(row['key'], system), audio.wav, audio.sr,
+                       audio.content_hash)
+    writer.close()
+    print(f'Packed {len(writer.entries["ref"])} reference and {len(writer.entries["deg"])} '
+          f'synthesised wavs into {len(writer.shards)} shards in {args.output_dir}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import argparse
+from evaluation.hypotheses import HypothesisStore
+from evaluation.wer import rescore_file
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="recompute the wer of a result file from stored asr hypotheses, without running asr.")
+    parser.add_argument(
+        "--result_file",
+        type=str,
+        required=True,
+        help="result file written by main.py, jsonl or parquet",
+    )
+    parser.add_argument(
+        "--output_file",
+        type=str,
+        required=True,
+        help="result file with the rescored wer fields, parquet if it ends with .parquet",
+    )
+    parser.add_argument(
+        "--lang",
+        type=str,
+        required=True,
+        help="language of the text, choose between zh and en"
+    )
+    parser.add_argument(
+        "--hyp_file",
+        type=str,
+        default=None,
+        help="hypothesis sidecar written by main.py --hyp_file, matched to the rows by their hyp_id, "
+             "the normalized hyp_txt of the result file is used if not set or not matched"
+    )
+    parser.add_argument(
+        "--asr_model",
+        type=str,
+        default=None,
+        help="only use hypotheses of this asr model id, e.g. faster-whisper/large-v3"
+    )
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        default=None,
+        help="input json file of main.py, its raw 'text' replaces the stored ref_txt"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    assert args.lang in ['zh', 'en']
+    hyp_texts = {}
+    if args.hyp_file is not None:
+        # by hypothesis id (audio content, model and decoding parameters), which
+        # the rows record as hyp_id, a path may carry several hypotheses
+        for entry in HypothesisStore.entries(args.hyp_file):
+            if args.asr_model is None or entry['model'] == args.asr_model:
+                hyp_texts[entry['id']] = entry['hyp']
+    ref_texts = {}
+    if args.input_file is not None:
+        with open(args.input_file, 'r') as fin:
+            for line in fin:
+                row = json.loads(line)
+                if 'text' in row:
+                    ref_texts[row['key']] = row['text']
+    rows = rescore_file(args.result_file, args.output_file, args.lang, ref_texts, hyp_texts)
+    print(f'Rescored {rows} rows, save result to {args.output_file}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Copyright (c) 2024, Shengqiang Li (shengqiangli@mail.nwpu.edu.cn)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from evaluation.cli import add_scoring_args, check_scoring_args, metric_options, asr_options, open_cache
+from evaluation.metrics import ModelHub, default_builders
+from evaluation.service import EvalService, make_server
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="evaluation service keeping the models loaded, e.g. "
+                    "curl -N -X POST localhost:8765/score "
+                    "-d '{\"input_file\": \"examples/input.json\", \"wav_dir\": \"examples/gen_wav\"}'")
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="address to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="port to listen on"
+    )
+    parser.add_argument(
+        "--unix_socket",
+        type=str,
+        default=None,
+        help="listen on this unix socket instead of host:port (curl --unix-socket)"
+    )
+    parser.add_argument(
+        "--preload",
+        type=str,
+        default="",
+        help="comma separated models (asr, sv, utmos) built at startup instead of by the first job"
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=16,
+        help="maximum rows, from any number of jobs, scored in one pass"
+    )
+    parser.add_argument(
+        "--batch_wait_ms",
+        type=float,
+        default=50,
+        help="time waited for rows of other jobs before scoring a partial window"
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="processes computing pesq, f0 rmse and mcd, 0 computes them in the service"
+    )
+    add_scoring_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    # jobs may ask for any metric, --lang is always required
+    check_scoring_args(args)
+    assert args.window >= 1
+    cache = open_cache(args)
+    models = ModelHub(default_builders(
+        args.lang, args.device, args.sim_model, args.utmos_model_dir, cache, args.hyp_file,
+        asr_options(args)))
+    for name in [name.strip() for name in args.preload.split(',') if name.strip()]:
+        models.get(name)
+    executor = None
+    if args.num_workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=args.num_workers, mp_context=multiprocessing.get_context('spawn'))
+    service = EvalService(
+        models, args.batch_size, args.window, args.batch_wait_ms / 1000, cache,
+        metric_options(args), executor)
+    server = make_server(service, args.host, args.port, args.unix_socket)
+    print(f'Serving on {args.unix_socket or f"{args.host}:{args.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()